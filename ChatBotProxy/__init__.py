@@ -1,10 +1,16 @@
+import json
 import os
 
 import click
 from dotenv import load_dotenv, find_dotenv
 
-from ChatBotProxy.main_engine.import_docu import ContextManager
-from ChatBotProxy.main_engine.query_ollama import query_ollama, build_question_prompt
+from ChatBotProxy.main_engine.benchmark import run_benchmark, compare_results, load_results
+from ChatBotProxy.main_engine.fake_ollama import FakeOllamaServer
+from ChatBotProxy.main_engine.import_docu import ContextManager, DEFAULT_CORPUS, corpus_names, setup_corpus
+from ChatBotProxy.main_engine.index_bench import run_index_bench, synthetic_embeddings, sample_queries
+from ChatBotProxy.main_engine.index_factory import INDEX_TYPES, INDEX_METRICS
+from ChatBotProxy.main_engine.jobs import try_lock_corpus
+from ChatBotProxy.main_engine.query_ollama import query_ollama, stream_ollama, prepare_answer, RETRIEVAL_MODES
 from ChatBotProxy.run_gunicorn import run
 
 # Load environment variables from the .env file
@@ -20,19 +26,44 @@ def cli():
 def print_update(method_type: str, value: dict):
     if method_type == 'meta':
         click.echo(f"Number of all links: {value['len']}")
-    if method_type in ['links', 'index', 'links-meta', 'generate_questions', 'generated_questions']:
+    if method_type in ['links', 'index', 'links-meta', 'generate_questions', 'generated_questions', 'llm-cache',
+                       'timing']:
         click.echo(f"{method_type} -> {value['text']}")
 
 
+def setup_context(corpus: str | None, url: str | None, path: str | None, embedding_model: str,
+                  llm_model: str | None) -> ContextManager:
+    """The context manager of corpus; --url and --path only apply to the default corpus."""
+    corpus = corpus or DEFAULT_CORPUS
+    if corpus not in corpus_names():
+        raise click.ClickException(f"Unknown corpus {corpus}, use one of {', '.join(corpus_names())}")
+    if corpus != DEFAULT_CORPUS:
+        return setup_corpus(corpus, embedding_model, llm_model)
+    return setup_corpus(corpus, embedding_model, llm_model, url=url, path=path)
+
+
+def run_locked(func, *args):
+    # The same corpus lock as the jobs of the server, so the CLI never rebuilds a corpus a job is working on
+    docu_root = func.__self__.docu_root()
+    lock = try_lock_corpus(docu_root)
+    if lock is None:
+        raise click.ClickException(f"Another job is running on {docu_root}")
+    try:
+        return func(*args)
+    finally:
+        lock.close()
+
+
 @cli.command(help="Generate questions for the documentation of Chemotion")
 @click.option('--url', '-u', default=os.getenv('DOCUSAURUS_URL'), help="Docusaurus url")
 @click.option('--path', '-p', default=os.getenv('DOCUSAURUS_BASE_PATH'), help="Docusaurus url base path")
 @click.option('--embedding_model', '-em', default=os.getenv('EMBEDDING_MODEL'), help="Docusaurus url base path")
 @click.option('--llm_model', '-llm', default=os.getenv('LLM_MODEL'), help="Docusaurus url base path")
-def questions(url, path, embedding_model, llm_model):
-    ContextManager().setup(embedding_model, url, llm_model, path)
+@click.option('--corpus', default=None, help="Named corpus of CORPORA instead of the DOCUSAURUS_URL one")
+def questions(url, path, embedding_model, llm_model, corpus):
+    cm = setup_context(corpus, url, path, embedding_model, llm_model)
 
-    ContextManager().generate_questions(print_update)
+    run_locked(cm.generate_questions, print_update)
 
 
 @cli.command(help="FAISS index documentation of Chemotion")
@@ -40,10 +71,22 @@ def questions(url, path, embedding_model, llm_model):
 @click.option('--path', '-p', default=os.getenv('DOCUSAURUS_BASE_PATH'), help="Docusaurus url base path")
 @click.option('--embedding_model', '-em', default=os.getenv('EMBEDDING_MODEL'), help="Docusaurus url base path")
 @click.option('--llm_model', '-llm', default=os.getenv('LLM_MODEL'), help="Docusaurus url base path")
-def index(url, path, embedding_model, llm_model):
-    ContextManager().setup(embedding_model, url, llm_model, path)
+@click.option('--corpus', default=None, help="Named corpus of CORPORA instead of the DOCUSAURUS_URL one")
+def index(url, path, embedding_model, llm_model, corpus):
+    cm = setup_context(corpus, url, path, embedding_model, llm_model)
 
-    ContextManager().index_chunks(print_update)
+    run_locked(cm.index_chunks, print_update)
+
+
+@cli.command(name='index-questions', help="Index the generated questions to answer matching questions directly")
+@click.option('--url', '-u', default=os.getenv('DOCUSAURUS_URL'), help="Docusaurus url")
+@click.option('--path', '-p', default=os.getenv('DOCUSAURUS_BASE_PATH'), help="Docusaurus url base path")
+@click.option('--embedding_model', '-em', default=os.getenv('EMBEDDING_MODEL'), help="Docusaurus url base path")
+@click.option('--corpus', default=None, help="Named corpus of CORPORA instead of the DOCUSAURUS_URL one")
+def index_questions(url, path, embedding_model, corpus):
+    cm = setup_context(corpus, url, path, embedding_model, None)
+
+    run_locked(cm.index_questions, print_update)
 
 
 @cli.command(help="Fetch and update documentation of Chemotion")
@@ -51,10 +94,12 @@ def index(url, path, embedding_model, llm_model):
 @click.option('--path', '-p', default=os.getenv('DOCUSAURUS_BASE_PATH'), help="Docusaurus url base path")
 @click.option('--embedding_model', '-em', default=os.getenv('EMBEDDING_MODEL'), help="Docusaurus url base path")
 @click.option('--llm_model', '-llm', default=os.getenv('LLM_MODEL'), help="Docusaurus url base path")
-def update(url, path, embedding_model, llm_model):
-    ContextManager().setup(embedding_model, url, llm_model, path)
+@click.option('--incremental', '-i', is_flag=True, help="Only re-process pages which changed since the last update")
+@click.option('--corpus', default=None, help="Named corpus of CORPORA instead of the DOCUSAURUS_URL one")
+def update(url, path, embedding_model, llm_model, incremental, corpus):
+    cm = setup_context(corpus, url, path, embedding_model, llm_model)
 
-    ContextManager().fetch_documents(print_update)
+    run_locked(cm.fetch_documents, print_update, incremental)
 
 
 @cli.command(help="Ask ollama")
@@ -63,13 +108,88 @@ def update(url, path, embedding_model, llm_model):
 @click.option('--url', '-u', default=os.getenv('DOCUSAURUS_URL'), help="Docusaurus url")
 @click.option('--path', '-p', default=os.getenv('DOCUSAURUS_BASE_PATH'), help="Docusaurus url base path")
 @click.option('--embedding_model', '-em', default=os.getenv('EMBEDDING_MODEL'), help="Docusaurus url base path")
-def answer(url, path, embedding_model, question, llm_model):
-    ContextManager().setup(embedding_model, url, llm_model, path)
-    prompt = build_question_prompt(question)
+@click.option('--stream', '-s', is_flag=True, help="Print the answer while it is generated")
+@click.option('--mode', '-m', type=click.Choice(RETRIEVAL_MODES), default=None, help="Retrieval mode")
+@click.option('--corpus', default=None, help="Named corpus of CORPORA instead of the DOCUSAURUS_URL one")
+def answer(url, path, embedding_model, question, llm_model, stream, mode, corpus):
+    setup_context(corpus, url, path, embedding_model, llm_model)
+    generated, prompt = prepare_answer(question, mode, corpus)
+    if generated is not None:
+        click.echo(generated['answer'])
+        click.echo(f"(Pre-generated answer of: {generated['generated']['question']})", err=True)
+        return
+    if stream:
+        for chunk in stream_ollama(prompt, llm_model):
+            if 'error' in chunk:
+                click.echo(chunk['error'], err=True)
+            click.echo(chunk.get('token', ''), nl=chunk['done'])
+        return
     res = query_ollama(prompt, llm_model)
     click.echo(res['answer'])
 
 
+@cli.command(name='index-bench', help="Compare build time, memory, latency and recall of the FAISS index types")
+@click.option('--url', '-u', default=os.getenv('DOCUSAURUS_URL'), help="Docusaurus url")
+@click.option('--path', '-p', default=os.getenv('DOCUSAURUS_BASE_PATH'), help="Docusaurus url base path")
+@click.option('--embedding_model', '-em', default=os.getenv('EMBEDDING_MODEL'), help="Docusaurus url base path")
+@click.option('--types', '-t', multiple=True, type=click.Choice(INDEX_TYPES), default=INDEX_TYPES, help="Index types")
+@click.option('--metric', '-m', type=click.Choice(INDEX_METRICS), default=os.getenv('INDEX_METRIC', 'l2'), help="Metric")
+@click.option('--k', '-k', default=10, help="Neighbours per query for recall@k")
+@click.option('--queries', '-q', default=200, help="Number of benchmark queries")
+@click.option('--synthetic', '-s', default=0, help="Benchmark N synthetic vectors instead of the indexed chunks")
+@click.option('--as_json', '-j', is_flag=True, help="Print the results as JSON")
+@click.option('--corpus', default=None, help="Named corpus of CORPORA instead of the DOCUSAURUS_URL one")
+def index_bench(url, path, embedding_model, types, metric, k, queries, synthetic, as_json, corpus):
+    cm = setup_context(corpus, url, path, embedding_model, None)
+    if synthetic > 0:
+        dimension = cm.get_embedding_model().get_sentence_embedding_dimension()
+        embeddings = synthetic_embeddings(synthetic, dimension)
+    else:
+        embeddings = run_locked(cm.document_embeddings)
+    results = run_index_bench(embeddings, sample_queries(embeddings, queries), k, types, metric)
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+    for res in results:
+        click.echo(' | '.join(f'{key}: {value}' for key, value in res.items()))
+
+
+@cli.command(help="Benchmark crawl, ingestion, embedding, indexing, retrieval and /chat on a synthetic corpus")
+@click.option('--embedding_model', '-em', default=os.getenv('EMBEDDING_MODEL'), help="Embedding model")
+@click.option('--pages', default=50, help="Pages of the synthetic Docusaurus site")
+@click.option('--sections', default=6, help="Sections per page")
+@click.option('--queries', '-q', default=200, help="Retrieval queries per mode")
+@click.option('--top_k', '-k', default=10, help="Chunks retrieved per query")
+@click.option('--requests', '-r', 'chat_requests', default=200, help="/chat requests")
+@click.option('--concurrency', '-c', default=8, help="Concurrent /chat clients")
+@click.option('--llm', type=click.Choice(['fake', 'sample']), default='fake', help="Fake ollama server or sample answer")
+@click.option('--token_delay', '-d', default=0.0, help="Seconds between tokens of the fake ollama server")
+@click.option('--chat_url', default=None, help="Load test this running /chat endpoint instead of an in-process server")
+@click.option('--output', '-o', default=None, help="Write the JSON results to this file")
+@click.option('--baseline', '-b', default=None, help="JSON results of an earlier run to compare with")
+def benchmark(embedding_model, pages, sections, queries, top_k, chat_requests, concurrency, llm, token_delay, chat_url,
+              output, baseline):
+    results = run_benchmark(embedding_model, pages, sections, queries=queries, top_k=top_k,
+                            chat_requests=chat_requests, concurrency=concurrency, llm=llm, token_delay=token_delay,
+                            chat_url=chat_url)
+    if baseline:
+        results['change'] = compare_results(load_results(baseline), results)
+    if output:
+        with open(output, 'w+') as f:
+            f.write(json.dumps(results, indent=2))
+    click.echo(json.dumps(results, indent=2))
+
+
+@cli.command(name='fake-ollama', help="Run a fake ollama server answering with the sample answer (for tests)")
+@click.option('--host', default='127.0.0.1', help="Host to bind")
+@click.option('--port', default=11434, help="Port to bind")
+@click.option('--token_delay', '-d', default=0.0, help="Seconds between streamed tokens")
+def fake_ollama(host, port, token_delay):
+    server = FakeOllamaServer(host, port, token_delay=token_delay)
+    click.echo(f"Fake ollama listening on {server.url}")
+    server.serve_forever()
+
+
 @cli.command(help="Serve proxy server")
 def serve():
     run()
@@ -1,12 +1,16 @@
 import os
 
-from threading import Thread
+import json
 from dotenv import load_dotenv, find_dotenv
-from flask import Flask, request, jsonify, render_template
-from flask_socketio import SocketIO
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
+from flask_socketio import SocketIO, emit
 
-from ChatBotProxy.main_engine.import_docu import ContextManager
-from ChatBotProxy.main_engine.query_ollama import query_ollama, build_question_prompt
+from ChatBotProxy.main_engine.import_docu import ContextManager, DEFAULT_CORPUS, corpus_names, setup_corpora
+from ChatBotProxy.main_engine.jobs import ACTIVE_STATES, JobRunner, get_job_runner
+from ChatBotProxy.main_engine.metrics import count_cache, render_metrics, span
+from ChatBotProxy.main_engine.query_ollama import query_ollama, stream_ollama, prepare_answer, retrieval_mode, \
+    RETRIEVAL_MODES
+from ChatBotProxy.main_engine.utils import server_mode
 
 template_dir = os.path.join(os.path.dirname(__file__), 'templates')
 app = Flask(__name__, template_folder=template_dir)
@@ -16,7 +20,11 @@ load_dotenv(find_dotenv(usecwd=True))
 
 # Apply configuration from environment variables
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default_secret_key')
-socketio = SocketIO(app)
+# With gevent workers every worker serves many clients and events of background jobs have to reach
+# clients connected to other workers, which needs a message queue (e.g. redis://localhost:6379/0).
+# Without one, Socket.IO events only reach the clients of the emitting process.
+socketio = SocketIO(app, async_mode='gevent' if server_mode() == 'gevent' else 'threading',
+                    message_queue=os.getenv('SOCKETIO_MESSAGE_QUEUE') or None)
 
 config = {
     'llm': os.getenv('LLM_MODEL'),
@@ -25,9 +33,15 @@ config = {
     'embedding_model': os.getenv('EMBEDDING_MODEL'),
 }
 
-ContextManager().setup(config['embedding_model'], config['url'], config['llm'], config['path'])
+# The default corpus (DOCUSAURUS_URL) and the named corpora of CORPORA, all sharing one embedding model
+setup_corpora(config['embedding_model'], config['llm'])
 
-MAIN_DOCU_THREAD = None
+
+@app.context_processor
+def socketio_config():
+    # Gunicorn has no sticky sessions, so with several gevent workers the clients must not fall back
+    # to long-polling, whose requests could end up on different workers.
+    return {'socketio_transports': ['websocket'] if server_mode() == 'gevent' else ['polling', 'websocket']}
 
 
 
@@ -35,45 +49,81 @@ MAIN_DOCU_THREAD = None
 def send_update(method_type: str, value: dict):
     if method_type == 'meta':
         socketio.emit('meda_data', {'links_len': value['len']})
-    if method_type in ['links', 'index', 'links-meta', 'generate_questions', 'generated_questions']:
+    if method_type in ['links', 'index', 'links-meta', 'generate_questions', 'generated_questions', 'llm-cache',
+                       'timing', 'job']:
         socketio.emit(method_type, value)
 
-@app.route('/update', methods=['GET'])
-def handle_update():
-    global MAIN_DOCU_THREAD
-    if MAIN_DOCU_THREAD is not None and MAIN_DOCU_THREAD.is_alive():
-        return render_template("index.html", header="Process is already running")
+JOB_HANDLERS = {
+    'update': lambda job: ContextManager(job.corpus).fetch_documents(job.log_handler,
+                                                                    job.params.get('incremental', False), job),
+    'index_chunks': lambda job: ContextManager(job.corpus).index_chunks(job.log_handler, job),
+    'generate_questions': lambda job: ContextManager(job.corpus).generate_questions(job.log_handler, job),
+    'index_questions': lambda job: ContextManager(job.corpus).index_questions(job.log_handler, job),
+}
 
-    MAIN_DOCU_THREAD = Thread(target=ContextManager().fetch_documents, args=(send_update,))
-    MAIN_DOCU_THREAD.daemon = True
-    MAIN_DOCU_THREAD.start()
-    return render_template("index.html", header="Starting new process")
 
+def job_runner() -> JobRunner:
+    return get_job_runner(JOB_HANDLERS, send_update)
 
 
-@app.route('/index_chunks', methods=['GET'])
-def index_chunks():
-    global MAIN_DOCU_THREAD
-    if MAIN_DOCU_THREAD is not None and MAIN_DOCU_THREAD.is_alive():
-        return render_template("index.html", header="Process is already running")
+@app.before_request
+def start_job_runner():
+    # Starts polling for queued and interrupted jobs in this worker
+    job_runner()
+
+
+def _submit_job(kind: str, template: str, **params):
+    corpus = request.args.get('corpus', DEFAULT_CORPUS)
+    if corpus not in corpus_names():
+        return render_template(template, header=f"Unknown corpus {corpus}"), 404
+    job, created = job_runner().submit(kind, corpus, ContextManager(corpus).docu_root(), params)
+    if not created:
+        return render_template(template, header=f"Process is already running (job {job['id']})")
+    return render_template(template, header=f"Starting new process (job {job['id']})")
+
+
+@app.route('/update', methods=['GET'])
+def handle_update():
+    incremental = request.args.get('incremental', 'false').lower() == 'true'
+    return _submit_job('update', "index.html", incremental=incremental)
 
-    MAIN_DOCU_THREAD = Thread(target=ContextManager().index_chunks, args=(send_update,))
-    MAIN_DOCU_THREAD.daemon = True
-    MAIN_DOCU_THREAD.start()
-    return render_template("index.html", header="Starting new process")
 
+@app.route('/index_chunks', methods=['GET'])
+def index_chunks():
+    return _submit_job('index_chunks', "index.html")
 
 
 @app.route('/generate_questions', methods=['GET'])
 def generate_questions():
-    global MAIN_DOCU_THREAD
-    if MAIN_DOCU_THREAD is not None and MAIN_DOCU_THREAD.is_alive():
-        return render_template("index_questions.html", header="Process is already running")
+    return _submit_job('generate_questions', "index_questions.html")
+
+
+@app.route('/index_questions', methods=['GET'])
+def index_questions():
+    return _submit_job('index_questions', "index_questions.html")
+
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify(job_runner().store.recent(request.args.get('corpus'), int(request.args.get('limit', 50))))
 
-    MAIN_DOCU_THREAD = Thread(target=ContextManager().generate_questions, args=(send_update,))
-    MAIN_DOCU_THREAD.daemon = True
-    MAIN_DOCU_THREAD.start()
-    return render_template("index_questions.html", header="Starting new process")
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def job_status(job_id: int):
+    job = job_runner().store.get(job_id)
+    if job is None:
+        return jsonify({"error": f"No job {job_id}"}), 404
+    return jsonify(job)
+
+
+@app.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id: int):
+    job = job_runner().cancel(job_id)
+    if job is None:
+        return jsonify({"error": f"No job {job_id}"}), 404
+    if job['status'] not in ACTIVE_STATES and job['status'] != 'cancelled':
+        return jsonify(job | {"error": f"Job {job_id} is already {job['status']}"}), 409
+    return jsonify(job)
 
 
 @app.route('/chat', methods=['POST'])
@@ -83,8 +133,132 @@ def handle_post():
         return jsonify({"error": "No JSON payload provided"}), 400
     if not data:
         return jsonify({"error": "No JSON payload provided"}), 400
-    prompt = build_question_prompt(data['question'])
-    return jsonify(data | query_ollama(prompt, config['llm'])), 200
+    if data.get('mode') not in (None, *RETRIEVAL_MODES):
+        return jsonify({"error": f"mode must be one of {', '.join(RETRIEVAL_MODES)}"}), 400
+    corpus = data.get('corpus', DEFAULT_CORPUS)
+    if corpus not in corpus_names():
+        return jsonify({"error": f"Unknown corpus {corpus}, use one of {', '.join(corpus_names())}"}), 404
+    cached, embedding = _cached_answer(data['question'], data.get('mode'), corpus)
+    if data.get('stream'):
+        return Response(stream_with_context(_stream_answer(data['question'], cached, embedding, data.get('mode'),
+                                                           corpus)),
+                        mimetype='application/x-ndjson')
+    if cached is not None:
+        return jsonify(data | cached | {'cached': True}), 200
+    with span('chat.prompt'):
+        result, prompt = prepare_answer(data['question'], data.get('mode'), corpus, embedding)
+    if result is None:
+        with span('chat.llm'):
+            result = query_ollama(prompt, config['llm'])
+    answer_cache = ContextManager(corpus).get_answer_cache()
+    answer_cache and answer_cache.put(embedding, data['question'], result, retrieval_mode(data.get('mode')))
+    return jsonify(data | result), 200
+
+
+def _cached_answer(question: str, mode: str | None = None, corpus: str = DEFAULT_CORPUS):
+    """
+    Returns the cached answer (or None) and the question embedding, which the retrieval reuses. Answers
+    are cached per retrieval mode.
+    """
+    cm = ContextManager(corpus)
+    answer_cache = cm.get_answer_cache()
+    if answer_cache is None:
+        return None, None
+    with span('chat.answer_cache'):
+        # Embedded in the micro-batches of the retrieval
+        embedding = cm.get_query_batcher().embed(question)
+        cached = answer_cache.get(embedding, retrieval_mode(mode))
+    count_cache('answer', cached is not None)
+    return cached, embedding
+
+
+def _stream_chunks(question: str, cached: dict | None, embedding, mode: str | None = None,
+                   corpus: str = DEFAULT_CORPUS):
+    """
+    Streams the answer from ollama, or a cached or pre-generated answer as a single token, and caches
+    new answers.
+    """
+    if cached is not None:
+        yield {'token': cached['answer'], 'done': False}
+        yield {'done': True, 'stats': {}, 'cached': True, 'answer': cached['answer']}
+        return
+    answer = []
+    with span('chat.prompt'):
+        generated, prompt = prepare_answer(question, mode, corpus, embedding)
+    if generated is not None:
+        answer_cache = ContextManager(corpus).get_answer_cache()
+        answer_cache and answer_cache.put(embedding, question, generated, retrieval_mode(mode))
+        yield {'token': generated['answer'], 'done': False}
+        yield {'done': True, 'stats': {}} | generated
+        return
+    for chunk in stream_ollama(prompt, config['llm']):
+        if chunk.get('done'):
+            answer_cache = ContextManager(corpus).get_answer_cache()
+            if answer_cache and 'error' not in chunk:
+                answer_cache.put(embedding, question, {'answer': ''.join(answer)}, retrieval_mode(mode))
+            yield chunk | {'answer': ''.join(answer)}
+            return
+        answer.append(chunk['token'])
+        yield chunk
+
+
+def _stream_answer(question: str, cached: dict | None, embedding, mode: str | None = None,
+                   corpus: str = DEFAULT_CORPUS):
+    """Yields the answer as JSON lines: one {'token': ...} per piece, then {'done': true, 'answer', 'stats'}."""
+    for chunk in _stream_chunks(question, cached, embedding, mode, corpus):
+        if chunk.get('done'):
+            yield json.dumps(chunk) + '\n'
+        else:
+            yield json.dumps({'token': chunk['token']}) + '\n'
+
+
+@socketio.on('chat')
+def handle_chat(data):
+    if not data or 'question' not in data:
+        emit('chat_done', {"error": "No question provided", 'done': True})
+        return
+    if data.get('mode') not in (None, *RETRIEVAL_MODES):
+        emit('chat_done', {"error": f"mode must be one of {', '.join(RETRIEVAL_MODES)}", 'done': True})
+        return
+    corpus = data.get('corpus', DEFAULT_CORPUS)
+    if corpus not in corpus_names():
+        emit('chat_done', {"error": f"Unknown corpus {corpus}", 'done': True})
+        return
+    cached, embedding = _cached_answer(data['question'], data.get('mode'), corpus)
+    for chunk in _stream_chunks(data['question'], cached, embedding, data.get('mode'), corpus):
+        if chunk.get('done'):
+            emit('chat_done', data | chunk)
+        else:
+            emit('chat_token', {'token': chunk['token']})
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    # Readiness probe: 503 until this worker has the embedding model and an index of the corpus loaded
+    corpus = request.args.get('corpus', DEFAULT_CORPUS)
+    if corpus not in corpus_names():
+        return jsonify({'ready': False, 'error': f"Unknown corpus {corpus}"}), 404
+    cm = ContextManager(corpus)
+    if not cm.is_ready():
+        return jsonify({'ready': False}), 503
+    return jsonify({'ready': True, 'generation': cm.get_retrieval_store().snapshot().generation,
+                    'pid': os.getpid()}), 200
+
+
+@app.route('/corpora', methods=['GET'])
+def corpora():
+    return jsonify([{'name': name, 'url': ContextManager(name).base_url, 'loaded': ContextManager(name).is_loaded()}
+                    for name in corpus_names()])
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    rendered = render_metrics()
+    if rendered is None:
+        return Response('Metrics are disabled (METRICS=False) or prometheus_client is not installed\n', status=404,
+                        mimetype='text/plain')
+    body, content_type = rendered
+    return Response(body, content_type=content_type)
 
 
 if __name__ == '__main__':
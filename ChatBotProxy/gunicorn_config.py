@@ -4,6 +4,39 @@ import os
 # Load the .env file
 load_dotenv(find_dotenv(usecwd=True))
 
+if os.getenv('SERVER_MODE', 'sync').lower() == 'gevent':
+    # Before the app (and with it ssl, threading and requests) is imported, also by the preload
+    from gevent import monkey
+    monkey.patch_all()
+
 # Access environment variables
 bind = f"{os.getenv('HOST', '127.0.0.1')}:{os.getenv('PORT', '8000')}"
-workers = int(os.getenv('WORKERS', 4))
\ No newline at end of file
+workers = int(os.getenv('WORKERS', 4))
+# SERVER_MODE=gevent serves every worker with an event loop, so slow LLM calls do not pin workers
+worker_class = 'gevent' if os.getenv('SERVER_MODE', 'sync').lower() == 'gevent' else 'sync'
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', 1000))
+preload_app = os.getenv('PRELOAD', 'true').lower() == 'true'
+
+
+def on_starting(server):
+    # Runs in the master before the workers are forked
+    from ChatBotProxy.main_engine.metrics import setup_multiprocess_dir
+    setup_multiprocess_dir()
+    if preload_app:
+        from ChatBotProxy.run_gunicorn import preload
+        preload(workers)
+
+
+def post_fork(server, worker):
+    from ChatBotProxy.run_gunicorn import post_fork as _post_fork
+    _post_fork(server, worker)
+
+
+def post_worker_init(worker):
+    from ChatBotProxy.run_gunicorn import post_worker_init as _post_worker_init
+    _post_worker_init(worker)
+
+
+def child_exit(server, worker):
+    from ChatBotProxy.main_engine.metrics import mark_process_dead
+    mark_process_dead(worker.pid)
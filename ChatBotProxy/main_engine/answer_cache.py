@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+import faiss
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    In-memory cache of /chat answers, looked up by the cosine similarity of the question embedding.
+
+    A question whose embedding is at least threshold similar to a cached question of the same
+    partition gets the cached answer. Partitions keep apart the answers of requests that answer the same
+    question differently, e.g. with another retrieval mode. Entries expire after ttl seconds, the least
+    recently used entry is evicted once max_entries is reached and the whole cache is dropped when a
+    new doc index generation appears.
+    """
+
+    def __init__(self, get_generation: Callable[[], int]):
+        self._get_generation = get_generation
+        self._threshold = float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+        self._ttl = float(os.getenv('ANSWER_CACHE_TTL', 24 * 60 * 60))
+        self._max_entries = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 1000))
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._generation = None
+        self.hits = self.misses = 0
+
+    def _clear(self):
+        self._indexes.clear()
+        self._entries.clear()
+
+    def _remove(self, entry_id: int):
+        partition = self._entries.pop(entry_id)[0]
+        self._indexes[partition].remove_ids(np.array([entry_id], dtype=np.int64))
+
+    def _check_generation(self):
+        generation = self._get_generation()
+        if generation != self._generation:
+            self._clear()
+            self._generation = generation
+
+    @staticmethod
+    def _normalized(embedding: np.ndarray) -> np.ndarray:
+        embedding = np.array(embedding, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(embedding)
+        return embedding
+
+    def get(self, embedding: np.ndarray, partition: str = '') -> dict | None:
+        """Returns the cached answer of the question with this embedding, or None."""
+        embedding = self._normalized(embedding)
+        with self._lock:
+            self._check_generation()
+            index = self._indexes.get(partition)
+            if index is None or index.ntotal == 0:
+                self.misses += 1
+                return None
+            similarities, ids = index.search(embedding, 1)
+            entry_id = int(ids[0][0])
+            if entry_id < 0 or similarities[0][0] < self._threshold:
+                self.misses += 1
+                return None
+            _, question, answer, expires = self._entries[entry_id]
+            if expires < time.monotonic():
+                self._remove(entry_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return answer
+
+    def put(self, embedding: np.ndarray, question: str, answer: dict, partition: str = ''):
+        if 'error' in answer or self._max_entries <= 0:
+            return
+        embedding = self._normalized(embedding)
+        with self._lock:
+            self._check_generation()
+            while len(self._entries) >= self._max_entries:
+                self._remove(next(iter(self._entries)))
+            index = self._indexes.get(partition)
+            if index is None:
+                index = self._indexes[partition] = faiss.IndexIDMap2(faiss.IndexFlatIP(embedding.shape[1]))
+            entry_id, self._next_id = self._next_id, self._next_id + 1
+            self._entries[entry_id] = (partition, question, answer, time.monotonic() + self._ttl)
+            index.add_with_ids(embedding, np.array([entry_id], dtype=np.int64))
@@ -0,0 +1,110 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from ChatBotProxy.main_engine.metrics import span, set_queue_depth
+from ChatBotProxy.main_engine.utils import run_blocking
+
+
+class QueryBatcher:
+    """
+    Micro-batches concurrent retrieval requests of one worker.
+
+    Queries arriving within window_ms of the first waiting query (at most max_batch of them) are
+    embedded with one encode call and searched with one FAISS search over the stacked query matrix,
+    plus one search of the generated questions if the snapshot has a Q&A index. The results are
+    handed back to the waiting requests through futures. Queries embedded before (see embed) are
+    only searched.
+    """
+
+    def __init__(self, get_model, get_snapshot, window_ms: float | None = None, max_batch: int | None = None):
+        self._get_model = get_model
+        self._get_snapshot = get_snapshot
+        self._window = (window_ms if window_ms is not None else float(os.getenv('RETRIEVAL_BATCH_WINDOW_MS', 5))) / 1000
+        self._max_batch = max_batch or int(os.getenv('RETRIEVAL_MAX_BATCH', 32))
+        self._queue = queue.Queue()
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so every (gunicorn) worker process starts its own batch thread
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, daemon=True).start()
+                self._pid = os.getpid()
+
+    def _submit(self, query: str, embedding: np.ndarray | None, top_k: int | None):
+        if self._window <= 0:
+            return self._search_batch([(query, embedding, top_k, None)])[0]
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((query, embedding, top_k, future))
+        return future.result()
+
+    def embed(self, query: str) -> np.ndarray:
+        """The embedding of a single query, to look it up in the answer cache and search it later."""
+        return self._submit(query, None, None)[4]
+
+    def search(self, query: str, top_k: int, embedding: np.ndarray | None = None):
+        """Returns (distances, indices, Q&A matches, snapshot) for a single query."""
+        return self._submit(query, embedding, top_k)[:4]
+
+    def _search_batch(self, batch: list[tuple]) -> list[tuple]:
+        """The (distances, indices, Q&A matches, snapshot, embedding) of every (query, embedding, top_k, future)."""
+        missing = [i for i, (_, embedding, _, _) in enumerate(batch) if embedding is None]
+        embeddings = [embedding for _, embedding, _, _ in batch]
+        if missing:
+            with span('retrieval.embed_query'):
+                encoded = run_blocking(self._get_model().encode, [batch[i][0] for i in missing], convert_to_numpy=True)
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+        results = [(None, None, [], None, embedding) for embedding in embeddings]
+        searched = [i for i, (_, _, top_k, _) in enumerate(batch) if top_k is not None]
+        if not searched:
+            return results
+        snapshot = self._get_snapshot()
+        top_k = max(batch[i][2] for i in searched)
+        queries = np.stack([embeddings[i] for i in searched])
+        with span('retrieval.faiss_search'):
+            distances, indices = run_blocking(snapshot.search, queries, top_k)
+        qa_matches = [[] for _ in searched]
+        if snapshot.qa is not None:
+            with span('retrieval.qa_search'):
+                qa_matches = run_blocking(snapshot.qa.search, queries, int(os.getenv('QA_TOP_K', 5)))
+        for row, i in enumerate(searched):
+            k = batch[i][2]
+            results[i] = (distances[row][:k], indices[row][:k], qa_matches[row], snapshot, embeddings[i])
+        return results
+
+    def _collect(self) -> list[tuple]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._window
+        while len(batch) < self._max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        set_queue_depth('retrieval_batcher', self._queue.qsize())
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self._search_batch(batch)
+            except BaseException as e:
+                for *_, future in batch:
+                    future.set_exception(e)
+                continue
+            for (*_, future), result in zip(batch, results):
+                future.set_result(result)
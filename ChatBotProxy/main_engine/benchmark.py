@@ -0,0 +1,227 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+from ChatBotProxy.main_engine.crawler import DocusaurusCrawler
+from ChatBotProxy.main_engine.fake_ollama import FakeOllamaServer
+from ChatBotProxy.main_engine.import_docu import ContextManager
+from ChatBotProxy.main_engine.index_factory import IndexParams
+from ChatBotProxy.main_engine.query_ollama import search_index, RETRIEVAL_MODES
+
+WORDS = ('sample', 'reaction', 'molecule', 'inventory', 'device', 'analysis', 'attachment', 'collection', 'element',
+         'research_plan', 'wellplate', 'screen', 'spectrum', 'NMR', 'chemotion', 'repository', 'export', 'import',
+         'template', 'segment', 'dataset', 'container', 'metadata', 'user', 'group', 'share', 'sync', 'label',
+         'report', 'search', 'structure', 'editor', 'ketcher', 'literature', 'DOI', 'publication', 'settings')
+
+
+def write_synthetic_site(root: str, pages: int = 50, sections: int = 6, words: int = 120, seed: int = 0) -> str:
+    """Writes a Docusaurus like site with linked pages below root/docs and returns the base path."""
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(root, 'docs'), exist_ok=True)
+    for page in range(pages):
+        body = [f'<h1>Page {page} {rng.choice(WORDS)}</h1><p>{" ".join(rng.choices(WORDS, k=words // 2))}</p>']
+        for section in range(sections):
+            body.append(f'<h2>Section {section} {rng.choice(WORDS)}</h2><p>{" ".join(rng.choices(WORDS, k=words))}</p>')
+        links = ''.join(f"<a href='/docs/page{target}.html'>next</a>"
+                        for target in {(page + 1) % pages, rng.randrange(pages)})
+        html = f"<html><body><div class='theme-doc-markdown'>{''.join(body)}{links}</div></body></html>"
+        with open(os.path.join(root, 'docs', f'page{page}.html'), 'w') as f:
+            f.write(html)
+    with open(os.path.join(root, 'docs', 'index.html'), 'w') as f:
+        f.write("<html><body><div class='theme-doc-markdown'><h1>Docs</h1>"
+                "<a href='/docs/page0.html'>start</a></div></body></html>")
+    return '/docs/'
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def serve_directory(root: str):
+    """Serves root over HTTP (with Last-Modified / 304 support) on a free local port."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(_QuietHandler, directory=root))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@contextmanager
+def _environ(**values):
+    old = {key: os.environ.get(key) for key in values}
+    os.environ.update({key: str(value) for key, value in values.items()})
+    try:
+        yield
+    finally:
+        for key, value in old.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+@contextmanager
+def _cwd(path: str):
+    old = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(old)
+
+
+def _latencies(values: list[float]) -> dict:
+    return {
+        'count': len(values),
+        'p50_ms': round(float(np.percentile(values, 50)) * 1000, 3),
+        'p99_ms': round(float(np.percentile(values, 99)) * 1000, 3),
+        'mean_ms': round(float(np.mean(values)) * 1000, 3),
+    }
+
+
+def _timed(func, *args, **kwargs) -> tuple:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_chat(chat_url: str, questions: list[str], concurrency: int) -> dict:
+    """Sends every question once to POST chat_url from concurrency threads and reports RPS and latency."""
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def ask(question):
+        start = time.perf_counter()
+        try:
+            ok = session.post(chat_url, json={'question': question}, timeout=300).status_code == 200
+        except requests.RequestException:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        results, duration = _timed(lambda: list(executor.map(ask, questions)))
+    return {'requests': len(questions), 'concurrency': concurrency, 'errors': sum(not ok for ok, _ in results),
+            'duration_s': round(duration, 3), 'rps': round(len(questions) / duration, 2),
+            **_latencies([latency for _, latency in results])}
+
+
+def _questions(n: int, seed: int = 2) -> list[str]:
+    rng = random.Random(seed)
+    return [f'How do I {rng.choice(WORDS)} a {rng.choice(WORDS)} in the {rng.choice(WORDS)}? ({i})' for i in range(n)]
+
+
+def run_benchmark(embedding_model: str, pages: int = 50, sections: int = 6, words: int = 120, queries: int = 200,
+                  top_k: int = 10, chat_requests: int = 200, concurrency: int = 8, llm: str = 'fake',
+                  token_delay: float = 0.0, chat_url: str | None = None) -> dict:
+    """
+    Runs the ingestion, embedding, indexing, retrieval and /chat paths against a synthetic Docusaurus
+    site served locally and a fake ollama server (llm='fake') or the sample answer (llm='sample'),
+    in a temporary working directory. Returns the measurements as a JSON serializable dict.
+
+    The corpus is built from the raw chunks without the LLM preprocessing: the fake LLM answers every
+    prompt alike, and retrieval on identical chunks would measure nothing. It only answers /chat.
+    """
+    from werkzeug.serving import make_server
+    from ChatBotProxy.app import app
+
+    results = {'config': {'pages': pages, 'sections': sections, 'words': words, 'queries': queries, 'top_k': top_k,
+                          'chat_requests': chat_requests, 'concurrency': concurrency, 'llm': llm,
+                          'token_delay': token_delay, 'embedding_model': embedding_model,
+                          'index_type': IndexParams.from_env().kind}}
+    fake_ollama = FakeOllamaServer(token_delay=token_delay).start()
+    env = {'ONLY_SAMPLE_ANSWER': 'true' if llm == 'sample' else 'false', 'OLLAMA_URLS': fake_ollama.url,
+           'LLM_CACHE': 'false', 'ANSWER_CACHE': 'false', 'CRAWL_RATE_LIMIT': 0, 'INDEX_RELOAD_INTERVAL': 0}
+    try:
+        with tempfile.TemporaryDirectory() as work_dir, _environ(**env), _cwd(work_dir):
+            site_root = os.path.join(work_dir, 'site')
+            base_path = write_synthetic_site(site_root, pages, sections, words)
+            with serve_directory(site_root) as base_url:
+                pages_found, duration = _timed(lambda: DocusaurusCrawler(base_url, base_path).crawl())
+                results['crawl'] = {'pages': len(pages_found), 'duration_s': round(duration, 3),
+                                    'pages_per_s': round(len(pages_found) / duration, 2)}
+
+                cm = ContextManager()
+                cm.setup(embedding_model, base_url, 'benchmark', base_path)
+                with _environ(ONLY_SAMPLE_ANSWER='true'):
+                    _, duration = _timed(cm.fetch_documents)
+                    chunks = cm.get_chunks()
+                    distinct = len({chunks[chunk_id] for chunk_id in chunks.ids()})
+                    if distinct < 2:
+                        raise RuntimeError(f'The benchmark corpus has {distinct} distinct chunk texts, '
+                                           f'retrieval would be measured on identical documents')
+                    results['ingest'] = {'pages': len(pages_found), 'chunks': len(chunks), 'distinct_chunks': distinct,
+                                         'duration_s': round(duration, 3),
+                                         'pages_per_s': round(len(pages_found) / duration, 2),
+                                         'chunks_per_s': round(len(chunks) / duration, 2)}
+                    _, duration = _timed(cm.fetch_documents, incremental=True)
+                    results['incremental_ingest'] = {'duration_s': round(duration, 3),
+                                                     'pages_per_s': round(len(pages_found) / duration, 2)}
+
+                cm.get_embedding_model()
+                embeddings, duration = _timed(cm.document_embeddings)
+                results['embedding'] = {'texts': len(chunks), 'dimension': int(embeddings.shape[1]),
+                                        'duration_s': round(duration, 3),
+                                        'texts_per_s': round(len(chunks) / duration, 2)}
+                params = IndexParams.from_env()
+                ids = chunks.ids()
+                _, duration = _timed(params.build, embeddings, ids)
+                results['index_build'] = {'type': params.kind, 'vectors': len(ids), 'duration_s': round(duration, 4)}
+
+                questions = _questions(queries)
+                search_index(questions[0], top_k)
+                results['retrieval'] = {}
+                for mode in RETRIEVAL_MODES:
+                    latencies = [_timed(search_index, question, top_k, mode)[1] for question in questions]
+                    results['retrieval'][mode] = _latencies(latencies)
+
+                chat_questions = _questions(chat_requests, seed=3)
+                if chat_url:
+                    results['chat'] = bench_chat(chat_url, chat_questions, concurrency)
+                else:
+                    server = make_server('127.0.0.1', 0, app, threaded=True)
+                    threading.Thread(target=server.serve_forever, daemon=True).start()
+                    try:
+                        results['chat'] = bench_chat(f'http://127.0.0.1:{server.server_port}/chat', chat_questions,
+                                                     concurrency)
+                    finally:
+                        server.shutdown()
+    finally:
+        fake_ollama.stop()
+    return results
+
+
+def _flatten(results: dict, prefix: str = '') -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat |= _flatten(value, f'{prefix}{key}.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare_results(baseline: dict, current: dict) -> dict:
+    """Relative change (current / baseline - 1) of every measurement present in both results."""
+    old, new = _flatten({k: v for k, v in baseline.items() if k != 'config'}), \
+        _flatten({k: v for k, v in current.items() if k != 'config'})
+    return {key: round(value / old[key] - 1, 4) for key, value in new.items() if old.get(key)}
+
+
+def load_results(path: str) -> dict:
+    with open(path, 'r') as f:
+        return json.loads(f.read())
@@ -0,0 +1,212 @@
+import fcntl
+import json
+import mmap
+import os
+import sqlite3
+import threading
+import uuid
+
+CHUNK_STORE_FILE_NAME = 'chunks.sqlite'
+
+
+class ChunkReader:
+    """
+    Read-only view of a chunk store. The chunk texts stay in the memory mapped data file; the hits of a
+    search are sliced out of it without reading any other file.
+    """
+
+    def __init__(self, root: str):
+        conn = sqlite3.connect(f'file:{os.path.join(root, CHUNK_STORE_FILE_NAME)}?mode=ro', uri=True)
+        try:
+            # One read transaction, so the data file name and the offsets belong together
+            conn.execute('BEGIN')
+            data_file = conn.execute("SELECT value FROM meta WHERE key = 'data_file'").fetchone()[0]
+            # Stores written before the raw spans were recorded have no span columns
+            spans = 'span_start, span_end' if _has_span_columns(conn) else 'NULL, NULL'
+            rows = conn.execute(f'SELECT id, offset, length, url, header, seq, {spans} FROM chunks '
+                                'ORDER BY url, seq, id').fetchall()
+        finally:
+            conn.close()
+        self._meta = {row[0]: row[1:] for row in rows}
+        with open(os.path.join(root, data_file), 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+
+    def __len__(self) -> int:
+        return len(self._meta)
+
+    def __contains__(self, chunk_id) -> bool:
+        return int(chunk_id) in self._meta
+
+    def __getitem__(self, chunk_id) -> str:
+        return bytes(self.raw(chunk_id)).decode('utf-8')
+
+    def ids(self) -> list[int]:
+        """All chunk ids ordered by page and position in the page."""
+        return list(self._meta)
+
+    def raw(self, chunk_id) -> memoryview:
+        offset, length = self._meta[int(chunk_id)][:2]
+        return memoryview(self._mmap)[offset:offset + length]
+
+    def fragmentation(self) -> float:
+        """Share of the data file taken by removed chunks."""
+        live = sum(meta[1] for meta in self._meta.values())
+        return 1 - live / len(self._mmap) if len(self._mmap) else 0.0
+
+    def meta(self, chunk_id) -> dict:
+        """
+        The source of a chunk. span is the (start, end) of the raw text the chunk was prepared from,
+        within its page, or None for chunks stored without it.
+        """
+        _, _, url, header, seq, span_start, span_end = self._meta[int(chunk_id)]
+        span = (span_start, span_end) if span_start is not None else None
+        return {'id': int(chunk_id), 'url': url, 'header': header, 'seq': seq, 'span': span}
+
+
+class ChunkWriter:
+    """
+    Writes a chunk store: an append-only data file with all chunk texts and an SQLite table with the
+    offset, length, source url, section header, position and raw span of every chunk, keyed by the
+    FAISS id.
+
+    A rebuild writes a fresh data file and database and swaps the database in with one rename, so
+    readers never see a half written store. Appending keeps the data file and commits the new rows in
+    one transaction.
+    """
+
+    def __init__(self, root: str, rebuild: bool = False):
+        self._root = root
+        self._path = os.path.join(root, CHUNK_STORE_FILE_NAME)
+        self._rebuild = rebuild or not os.path.exists(self._path)
+        self._old_data_file = None
+        if self._rebuild:
+            self._db_path = self._path + '.tmp'
+            if os.path.exists(self._db_path):
+                os.remove(self._db_path)
+            if os.path.exists(self._path):
+                self._old_data_file = self._read_data_file(self._path)
+        else:
+            self._db_path = self._path
+        self._conn = sqlite3.connect(self._db_path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, offset INTEGER NOT NULL, '
+                           'length INTEGER NOT NULL, url TEXT, header TEXT, seq INTEGER, span_start INTEGER, '
+                           'span_end INTEGER)')
+        if not _has_span_columns(self._conn):
+            self._conn.execute('ALTER TABLE chunks ADD COLUMN span_start INTEGER')
+            self._conn.execute('ALTER TABLE chunks ADD COLUMN span_end INTEGER')
+        if self._rebuild:
+            self._data_file = f'chunks.{uuid.uuid4().hex}.dat'
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('data_file', ?)", (self._data_file,))
+        else:
+            self._data_file = self._conn.execute("SELECT value FROM meta WHERE key = 'data_file'").fetchone()[0]
+        self._data = open(os.path.join(root, self._data_file), 'ab')
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read_data_file(db_path: str) -> str:
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute("SELECT value FROM meta WHERE key = 'data_file'").fetchone()[0]
+        finally:
+            conn.close()
+
+    def add(self, chunk_id: int, text: str, url: str | None = None, header: str | None = None, seq: int = 0,
+            span: tuple[int, int] | None = None):
+        data = text.encode('utf-8')
+        span_start, span_end = span or (None, None)
+        with self._lock:
+            offset = self._data.tell()
+            self._data.write(data)
+            self._conn.execute('INSERT OR REPLACE INTO chunks (id, offset, length, url, header, seq, span_start, '
+                               'span_end) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                               (int(chunk_id), offset, len(data), url, header, seq, span_start, span_end))
+
+    def move(self, chunk_id: int, seq: int, span: tuple[int, int] | None = None):
+        """Updates the position of a kept chunk whose page changed around it."""
+        span_start, span_end = span or (None, None)
+        with self._lock:
+            self._conn.execute('UPDATE chunks SET seq = ?, span_start = ?, span_end = ? WHERE id = ?',
+                               (seq, span_start, span_end, int(chunk_id)))
+
+    def remove(self, chunk_ids: list[int]):
+        with self._lock:
+            self._conn.executemany('DELETE FROM chunks WHERE id = ?', [(int(i),) for i in chunk_ids])
+
+    def commit(self):
+        self._data.flush()
+        os.fsync(self._data.fileno())
+        self._data.close()
+        self._conn.commit()
+        self._conn.close()
+        if self._rebuild:
+            os.replace(self._db_path, self._path)
+            if self._old_data_file and self._old_data_file != self._data_file:
+                # Workers that still map the old data file keep it alive until they swap
+                os.remove(os.path.join(self._root, self._old_data_file))
+
+    def abort(self):
+        """Drops everything written since the writer was opened."""
+        self._data.close()
+        self._conn.rollback()
+        self._conn.close()
+        if self._rebuild:
+            os.remove(self._db_path)
+            os.remove(os.path.join(self._root, self._data_file))
+
+
+
+def compact(root: str):
+    """Rewrites the store without the bytes of removed chunks."""
+    reader = ChunkReader(root)
+    writer = ChunkWriter(root, rebuild=True)
+    for chunk_id in reader.ids():
+        meta = reader.meta(chunk_id)
+        writer.add(chunk_id, reader[chunk_id], meta['url'], meta['header'], meta['seq'], meta['span'])
+    writer.commit()
+
+
+def _has_span_columns(conn: sqlite3.Connection) -> bool:
+    return 'span_start' in {row[1] for row in conn.execute('PRAGMA table_info(chunks)')}
+
+
+def has_chunk_store(root: str) -> bool:
+    return os.path.exists(os.path.join(root, CHUNK_STORE_FILE_NAME))
+
+
+def migrate_legacy_layout(root: str):
+    """
+    Moves a docu root with one .txt file per chunk plus index.json into a chunk store. The source urls
+    are taken from manifest.json where available. Safe to call from several processes at once.
+    """
+    json_path = os.path.join(root, 'index.json')
+    # Also covers a docu root that was never fetched and does not exist yet
+    if not os.path.exists(json_path):
+        return
+    with open(os.path.join(root, '.migrate.lock'), 'w+') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if has_chunk_store(root) or not os.path.exists(json_path):
+            return
+        with open(json_path, 'r') as f:
+            docu_index = json.loads(f.read())
+        links = docu_index['links']
+        ids = docu_index.get('ids', list(range(len(links))))
+        origins = {}
+        manifest_path = os.path.join(root, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.loads(f.read())
+            for url, page in manifest['pages'].items():
+                for seq, chunk in enumerate(page['chunks']):
+                    origins[chunk['id']] = (url, seq)
+        writer = ChunkWriter(root, rebuild=True)
+        for position, (chunk_id, dl) in enumerate(zip(ids, links)):
+            # index.json holds absolute paths of the cwd the chunks were written from
+            file_path = os.path.join(root, os.path.basename(dl))
+            with open(file_path, 'r') as f:
+                url, seq = origins.get(chunk_id, (None, position))
+                writer.add(chunk_id, f.read(), url, None, seq)
+        writer.commit()
+        for dl in links:
+            os.remove(os.path.join(root, os.path.basename(dl)))
+        os.remove(json_path)
@@ -0,0 +1,92 @@
+import os
+import threading
+from typing import Callable
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_token_counter() -> Callable[[str], int]:
+    """
+    Counts tokens with the Hugging Face tokenizer named in LLM_TOKENIZER (the tokenizer of the ollama
+    model, e.g. microsoft/phi-4). Without one, ~4 characters per token are assumed.
+    """
+    global _tokenizer
+    name = os.getenv('LLM_TOKENIZER')
+    if not name:
+        return lambda text: (len(text) + 3) // 4
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                from transformers import AutoTokenizer
+                _tokenizer = AutoTokenizer.from_pretrained(name)
+    return lambda text: len(_tokenizer.encode(text, add_special_tokens=False))
+
+
+def _overlap(previous: str, text: str, min_length: int = 20) -> int:
+    """Length of the longest suffix of previous that text starts with."""
+    for length in range(min(len(previous), len(text)), min_length - 1, -1):
+        if previous.endswith(text[:length]):
+            return length
+    return 0
+
+
+def _contained(meta: dict, other: dict) -> bool:
+    """Whether the raw text of a chunk lies within the raw text of another chunk of the same page."""
+    span, other_span = meta['span'], other['span']
+    return meta['url'] == other['url'] and span is not None and other_span is not None and \
+        other_span[0] <= span[0] and span[1] <= other_span[1]
+
+
+def _merge(texts: list[str]) -> str:
+    merged = texts[0]
+    for text in texts[1:]:
+        overlap = _overlap(merged, text)
+        merged += text[overlap:] if overlap else '\n' + text
+    return merged
+
+
+def assemble_context(hits: list[int], chunks, token_budget: int, count_tokens: Callable[[str], int]) -> list[str]:
+    """
+    Turns the chunk ids of a search, best hit first, into the context passages of a prompt.
+
+    Hits whose raw span (see ChunkReader.meta) lies within the span of a better hit, or whose text
+    repeats or is contained in one, are dropped. The remaining hits are taken by relevance as long as
+    they fit into token_budget. Selected chunks that follow each other on the same page are merged
+    into one passage. The text the splitter lets them share is cut where it still matches; after the
+    LLM preprocessing rewrote the chunks it rarely does, and both versions stay. Passages are returned
+    in the order of their best hit.
+    """
+    selected, metas, texts, used = [], [], [], 0
+    for chunk_id in hits:
+        text, meta = chunks[chunk_id], chunks.meta(chunk_id)
+        if any(_contained(meta, other) for other in metas) or any(text in other for other in texts):
+            continue
+        tokens = count_tokens(text)
+        if used + tokens > token_budget:
+            if selected:
+                continue
+            # A single chunk larger than the budget is cut, an empty context helps nobody
+            text = text[:len(text) * token_budget // tokens]
+            tokens = token_budget
+        selected.append(chunk_id)
+        metas.append(meta)
+        texts.append(text)
+        used += tokens
+
+    pages = {}
+    for rank, (meta, text) in enumerate(zip(metas, texts)):
+        pages.setdefault(meta['url'], []).append((meta['seq'], rank, text))
+
+    passages = []
+    for page in pages.values():
+        page.sort()
+        run = [page[0]]
+        for previous, current in zip(page, page[1:]):
+            if current[0] != previous[0] + 1:
+                passages.append(run)
+                run = []
+            run.append(current)
+        passages.append(run)
+    passages.sort(key=lambda run: min(rank for _, rank, _ in run))
+    return [_merge([text for _, _, text in run]) for run in passages]
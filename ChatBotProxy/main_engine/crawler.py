@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+
+class HostRateLimiter:
+    """Spaces out requests to the same host by at least 1 / rate seconds."""
+
+    def __init__(self, rate: float):
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url: str):
+        if self._interval == 0:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class CrawledPage:
+    def __init__(self, html: str | None, etag: str | None = None, last_modified: str | None = None,
+                 links: list[str] | None = None, status: int = 200):
+        self.html = html
+        self.etag = etag
+        self.last_modified = last_modified
+        self.links = links or []
+        self.status = status
+
+    @property
+    def failed(self) -> bool:
+        return not 200 <= self.status < 300
+
+    @property
+    def not_modified(self) -> bool:
+        return self.html is None and not self.failed
+
+
+class DocusaurusCrawler:
+    """
+    Breadth-first crawler for all pages below base_path.
+
+    Each breadth-first level is fetched concurrently over one pooled session. The HTML of every
+    page is kept, so the pages only have to be downloaded once per crawl.
+    """
+
+    def __init__(self, base_url: str, base_path: str, concurrency: int | None = None, rate: float | None = None):
+        self._base_url, self._base_path = base_url, base_path
+        self._concurrency = concurrency or int(os.getenv('CRAWL_CONCURRENCY', 8))
+        self._rate_limiter = HostRateLimiter(rate if rate is not None else float(os.getenv('CRAWL_RATE_LIMIT', 10)))
+        # A hung docs host fails the update instead of blocking it forever
+        self._timeout = (float(os.getenv('CRAWL_CONNECT_TIMEOUT', 10)), float(os.getenv('CRAWL_READ_TIMEOUT', 30)))
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._concurrency)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def fetch(self, url: str) -> str:
+        page = self.fetch_page(url)
+        if page.failed:
+            raise requests.HTTPError(f'{url} answered with status {page.status}')
+        return page.html
+
+    def fetch_page(self, url: str, known: dict | None = None) -> CrawledPage:
+        """
+        Fetches a page. If known holds the etag/last_modified of an earlier crawl, a conditional GET
+        is sent and an unchanged page comes back without HTML but with the known links.
+
+        A known page that times out or answers with a transient error (5xx, 429) comes back the same
+        way, so it keeps its chunks of the last crawl. Any other error status, e.g. 404 or 410 of a
+        page deleted upstream, comes back as failed page without HTML, so the page is dropped.
+        """
+        if not url.startswith(self._base_url):
+            url = self._base_url + url
+        headers = {}
+        if known:
+            if known.get('etag'):
+                headers['If-None-Match'] = known['etag']
+            if known.get('last_modified'):
+                headers['If-Modified-Since'] = known['last_modified']
+        self._rate_limiter.wait(url)
+        try:
+            response = self._session.get(url, headers=headers, timeout=self._timeout)
+        except requests.Timeout:
+            if not known:
+                raise
+            return CrawledPage(None, known.get('etag'), known.get('last_modified'), known.get('links'))
+        transient = response.status_code >= 500 or response.status_code == 429
+        if response.status_code == 304 or (known and transient):
+            return CrawledPage(None, known.get('etag'), known.get('last_modified'), known.get('links'))
+        if not 200 <= response.status_code < 300:
+            return CrawledPage(None, status=response.status_code)
+        return CrawledPage(response.text, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                           self._extract_links(response.text))
+
+    def _extract_links(self, html: str) -> list[str]:
+        links = []
+        soup = BeautifulSoup(html, "html.parser")
+        for a_tag in soup.findAll("a"):
+            href = a_tag.attrs.get("href")
+            if href == "" or href is None:
+                continue
+            if href.startswith(self._base_url):
+                href = href.replace(self._base_url, '')
+            href = href.split('#')[0]
+            if href.startswith(self._base_path):
+                links.append(href)
+        return links
+
+    def crawl(self, known_pages: dict[str, dict] | None = None) -> dict[str, CrawledPage]:
+        """
+        Returns all reachable pages keyed by their path, in discovery order. New pages answering with
+        an error status are left out; if base_path itself fails, the crawl raises.
+
+        known_pages maps paths to the validators and links of an earlier crawl (see Manifest) and
+        turns the requests for these pages into conditional GETs.
+        """
+        known_pages = known_pages or {}
+        pages = {}
+        seen = {self._base_path}
+        frontier = [self._base_path]
+        with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+            while frontier:
+                next_frontier = []
+                fetched = executor.map(lambda u: self.fetch_page(u, known_pages.get(u)), frontier)
+                for url, page in zip(frontier, fetched):
+                    if page.failed:
+                        if url == self._base_path:
+                            raise requests.HTTPError(f'{self._base_url}{url} answered with status {page.status}')
+                        continue
+                    pages[url] = page
+                    for href in page.links:
+                        if href not in seen:
+                            seen.add(href)
+                            next_frontier.append(href)
+                frontier = next_frontier
+        return pages
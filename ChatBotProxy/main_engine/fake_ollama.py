@@ -0,0 +1,137 @@
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOllamaServer:
+    """
+    Minimal stand-in for an ollama server, for tests and benchmarks without a GPU.
+
+    POST /api/generate answers every prompt with sample_answer.md (or the given answer), as one JSON
+    object or as an NDJSON stream with token_delay seconds between the tokens. The first fail_first
+    requests get an HTTP 503 and streams end without their final message after cut_after tokens, to
+    exercise retries. All request payloads are kept in requests, the most requests answered at once in
+    max_concurrent.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, answer: str | None = None, token_delay: float = 0.0,
+                 fail_first: int = 0, cut_after: int | None = None):
+        if answer is None:
+            with open(os.path.join(os.path.dirname(__file__), 'sample_answer.md'), 'r') as f:
+                answer = f.read()
+        self.tokens = re.findall(r'\S+\s*|\s+', answer)
+        self.token_delay = token_delay
+        self.fail_first = fail_first
+        self.cut_after = cut_after
+        self.requests = []
+        self.max_concurrent = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                return True
+            return False
+
+    def _enter(self, delta: int):
+        with self._lock:
+            self._active += delta
+            self.max_concurrent = max(self.max_concurrent, self._active)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are separate writes, which Nagle's algorithm would delay on keep-alive connections
+            disable_nagle_algorithm = True
+
+            def _send_json(self, status: int, body: dict):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == '/api/tags':
+                    return self._send_json(200, {'models': []})
+                data = b'Ollama is running'
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                with fake._lock:
+                    fake.requests.append(payload)
+                if self.path != '/api/generate':
+                    return self._send_json(404, {'error': 'not found'})
+                if fake._should_fail():
+                    return self._send_json(503, {'error': 'server busy'})
+                fake._enter(1)
+                try:
+                    self._generate(payload)
+                finally:
+                    fake._enter(-1)
+
+            def _generate(self, payload: dict):
+                start = time.perf_counter_ns()
+                stats = {'model': payload.get('model'), 'prompt_eval_count': len(payload.get('prompt', '').split()),
+                         'eval_count': len(fake.tokens)}
+                if not payload.get('stream', True):
+                    time.sleep(fake.token_delay * len(fake.tokens))
+                    duration = time.perf_counter_ns() - start
+                    return self._send_json(200, stats | {'response': ''.join(fake.tokens), 'done': True,
+                                                         'total_duration': duration, 'eval_duration': duration})
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for token in fake.tokens[:fake.cut_after]:
+                    time.sleep(fake.token_delay)
+                    self._write_chunk({'model': payload.get('model'), 'response': token, 'done': False})
+                if fake.cut_after is not None:
+                    self.wfile.write(b'0\r\n\r\n')
+                    return
+                duration = time.perf_counter_ns() - start
+                self._write_chunk(stats | {'response': '', 'done': True, 'total_duration': duration,
+                                           'eval_duration': duration})
+                self.wfile.write(b'0\r\n\r\n')
+
+            def _write_chunk(self, body: dict):
+                data = (json.dumps(body) + '\n').encode('utf-8')
+                self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'FakeOllamaServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,55 +1,166 @@
-import json
 import os
 import re
 import shutil
 import threading
+import time
+from collections import OrderedDict
 from enum import Enum
 from typing import Callable
 
 import faiss
-import requests
+import numpy as np
 from bs4 import BeautifulSoup
 
 import html2text
 from sentence_transformers import SentenceTransformer
 
-from ChatBotProxy.main_engine.utils import query_ollama
+from ChatBotProxy.main_engine.answer_cache import SemanticAnswerCache
+from ChatBotProxy.main_engine.batcher import QueryBatcher
+from ChatBotProxy.main_engine.chunk_store import ChunkReader, ChunkWriter, compact, has_chunk_store, \
+    migrate_legacy_layout
+from ChatBotProxy.main_engine.crawler import DocusaurusCrawler
+from ChatBotProxy.main_engine.manifest import Manifest, content_hash
+from ChatBotProxy.main_engine.pipeline import Pipeline, Stage
+from ChatBotProxy.main_engine.qa_index import QAIndex, QA_INDEX_FILE_NAME, QA_RECORDS_FILE_NAME, parse_qa_pairs
+from ChatBotProxy.main_engine.retrieval_store import RetrievalStore, INDEX_FILE_NAME, bump_generation, stage_root, \
+    swap_root
+from ChatBotProxy.main_engine.index_factory import IndexParams
+from ChatBotProxy.main_engine.jobs import JobContext
+from ChatBotProxy.main_engine.lexical_index import BM25Index, LEXICAL_INDEX_FILE_NAME
+from ChatBotProxy.main_engine.llm_cache import get_llm_cache
+from ChatBotProxy.main_engine.metrics import span
+from ChatBotProxy.main_engine.utils import query_ollama, run_blocking
+
+# Part of the LLM cache key, increase it whenever the wording of a prompt below changes
+PROMPT_TEMPLATE_VERSION = 'v1'
+
+
+DEFAULT_CORPUS = 'default'
+
+# Loaded embedding models by name, shared by all corpora
+_embedding_models = {}
+_embedding_models_lock = threading.Lock()
+# Corpora with a loaded retrieval store, least recently used first
+_loaded_corpora = OrderedDict()
+_loaded_corpora_lock = threading.Lock()
 
 
-class ThreadSafeSingleton(type):
+class ContextTypes(Enum):
+    DOCUSAURUS = 1
+
+
+def corpus_names() -> list[str]:
+    """The default corpus plus the named corpora listed in CORPORA (comma separated)."""
+    names = [name.strip() for name in os.getenv('CORPORA', '').split(',') if name.strip()]
+    for name in names:
+        if not re.fullmatch(r'[A-Za-z0-9_-]+', name):
+            raise ValueError(f"Invalid corpus name {name}, use letters, digits, '_' and '-'")
+    return list(dict.fromkeys([DEFAULT_CORPUS] + names))
+
+
+def corpus_config(name: str) -> dict:
+    """Url, base path, context type and docu root of a corpus from CORPUS_<NAME>_* (default corpus: DOCUSAURUS_*)."""
+    if name == DEFAULT_CORPUS:
+        return {'url': os.getenv('DOCUSAURUS_URL'), 'path': os.getenv('DOCUSAURUS_BASE_PATH'),
+                'context_type': os.getenv('CONTEXT_TYPE', 'DOCUSAURUS'), 'root': os.getenv('DOCU_ROOT')}
+    prefix = f"CORPUS_{name.upper().replace('-', '_')}_"
+    return {'url': os.getenv(prefix + 'URL'), 'path': os.getenv(prefix + 'BASE_PATH', '/'),
+            'context_type': os.getenv(prefix + 'CONTEXT_TYPE', 'DOCUSAURUS'), 'root': os.getenv(prefix + 'ROOT')}
+
+
+def setup_corpus(name: str, embedding_model: str, llm: str, **overrides) -> 'ContextManager':
+    """Sets up a corpus from its configuration; overrides (url, path, context_type, root) win if not None."""
+    config = corpus_config(name) | {key: value for key, value in overrides.items() if value is not None}
+    context_manager = ContextManager(name)
+    context_manager.setup(embedding_model, config['url'], llm, config['path'],
+                          ContextTypes[config['context_type'].upper()], config['root'])
+    return context_manager
+
+
+def setup_corpora(embedding_model: str, llm: str):
+    for name in corpus_names():
+        setup_corpus(name, embedding_model, llm)
+
+
+def get_shared_embedding_model(name: str) -> SentenceTransformer:
+    model = _embedding_models.get(name)
+    if model is None:
+        with _embedding_models_lock:
+            if name not in _embedding_models:
+                with span('embedding_model.load'):
+                    _embedding_models[name] = SentenceTransformer(name)
+            model = _embedding_models[name]
+    return model
+
+
+class CorpusSingleton(type):
+    """One instance per corpus name, ContextManager() is the default corpus."""
     _instances = {}
     _singleton_lock = threading.Lock()
 
-    def __call__(cls, *args, **kwargs):
+    def __call__(cls, corpus: str | None = None):
+        corpus = corpus or DEFAULT_CORPUS
         # double-checked locking pattern (https://en.wikipedia.org/wiki/Double-checked_locking)
-        if cls not in cls._instances:
+        if corpus not in cls._instances:
             with cls._singleton_lock:
-                if cls not in cls._instances:
-                    cls._instances[cls] = super(ThreadSafeSingleton, cls).__call__(*args, **kwargs)
-        return cls._instances[cls]
-
-
-class ContextTypes(Enum):
-    DOCUSAURUS = 1
+                if corpus not in cls._instances:
+                    cls._instances[corpus] = super(CorpusSingleton, cls).__call__(corpus)
+        return cls._instances[corpus]
 
 
-class ContextManager(metaclass=ThreadSafeSingleton):
+class ContextManager(metaclass=CorpusSingleton):
 
-    def __init__(self):
+    def __init__(self, corpus: str = DEFAULT_CORPUS):
+        self.corpus = corpus
         self._base_url = self._base_path = self.context_types = self._embedding_model_name = None
-        self._embedding_model = self._embedding_model = self._docu_links = None
+        self._root = None
         self._llm = None
+        self._retrieval_store = None
+        self._query_batcher = None
+        self._answer_cache = None
+        self._crawler = None
+        self._pages = {}
 
         self._chunk_size = int(os.environ.get('CHUNK_SIZE', 2000))
 
     def setup(self, embedding_model: str, base_url: str, llm: str, base_path: str = '/',
-              context_types: ContextTypes = ContextTypes.DOCUSAURUS):
+              context_types: ContextTypes = ContextTypes.DOCUSAURUS, root: str | None = None):
         self._base_url, self._base_path = base_url, base_path
         self.context_types = context_types
+        # The model itself is shared, corpora with the same model name use the same loaded instance
         self._embedding_model_name = embedding_model
-        self._embedding_model = None
-        self._docu_links = []
         self._llm = llm
+        self._root = root
+        # The retrieval state belongs to the docu root of the previous setup
+        self.unload()
+        self._query_batcher = None
+
+    @property
+    def base_url(self) -> str | None:
+        return self._base_url
+
+    def is_loaded(self) -> bool:
+        retrieval_store = self._retrieval_store
+        return retrieval_store is not None and retrieval_store.is_loaded()
+
+    def unload(self):
+        """Drops the loaded index, chunk store and answer cache; the next query loads them again."""
+        self._retrieval_store = self._answer_cache = None
+
+    def _touch(self):
+        # Unloads the least recently used corpora beyond CORPUS_MAX_LOADED and those idle for CORPUS_IDLE_TIMEOUT
+        now = time.monotonic()
+        max_loaded, idle_timeout = int(os.getenv('CORPUS_MAX_LOADED', 4)), float(os.getenv('CORPUS_IDLE_TIMEOUT', 0))
+        evicted = []
+        with _loaded_corpora_lock:
+            _loaded_corpora[self.corpus] = (self, now)
+            _loaded_corpora.move_to_end(self.corpus)
+            for corpus, (context_manager, last_used) in list(_loaded_corpora.items())[:-1]:
+                if len(_loaded_corpora) > max(1, max_loaded) or 0 < idle_timeout < now - last_used:
+                    del _loaded_corpora[corpus]
+                    evicted.append(context_manager)
+        for context_manager in evicted:
+            context_manager.unload()
 
 
     def _get_html_selector(self):
@@ -57,43 +168,18 @@ class ContextManager(metaclass=ThreadSafeSingleton):
             return {'class': 'theme-doc-markdown'}
         return {}
 
-    def _get_all_website_links(self, urls: list | None = None, idx: int = 0):
-        if urls is None:
-            urls = list()
-            urls.append(self._base_path)
-
-        url = urls[idx]
-        response = requests.get(self._base_url + url)
-        soup = BeautifulSoup(response.text, "html.parser")
-        for a_tag in soup.findAll("a"):
-            href = a_tag.attrs.get("href")
-            if href == "" or href is None:
-                continue
-            if href.startswith(self._base_url):
-                href = href.replace(self._base_url, '')
-            href = href.split('#')[0]
-            if href.startswith(self._base_path) and href not in urls:
-                urls.append(href)
-
-        idx += 1
-        if idx < len(urls):
-            return self._get_all_website_links(urls, idx)
-        return list(dict.fromkeys(urls))
-
-    def _make_file_name(self, text, idx=None):
-        if text.startswith(self._base_url):
-            text = text[len(self._base_url):]
-        if text.endswith('.txt'):
-            text = text[:-4]
-        if idx is None:
-            return re.sub(r'/', '_', text) + '.txt'
-        return re.sub(r'/', '_', text) + '.' + str(idx) + '.txt'
+    def _get_all_website_links(self, manifest: Manifest | None = None) -> list[str]:
+        self._crawler = DocusaurusCrawler(self._base_url, self._base_path)
+        self._pages = self._crawler.crawl(manifest and manifest.validators())
+        return list(self._pages)
 
     def _extract_text_from_web(self, url_docu):
-        if not url_docu.startswith(self._base_url):
-            url_docu = self._base_url + url_docu
-        response = requests.get(url_docu)
-        soup = BeautifulSoup(response.text, 'html.parser')
+        page = self._pages.get(url_docu)
+        if page is not None and not page.not_modified:
+            html = page.html
+        else:
+            html = (self._crawler or DocusaurusCrawler(self._base_url, self._base_path)).fetch(url_docu)
+        soup = BeautifulSoup(html, 'html.parser')
         div = soup.find('div', self._get_html_selector())
         h = html2text.HTML2Text()
         if not div:
@@ -106,128 +192,423 @@ class ContextManager(metaclass=ThreadSafeSingleton):
     def _fp(path_name: str) -> str:
         return os.path.join(os.getcwd(), path_name)
 
-    @classmethod
-    def docu_root(cls) -> str:
-        return cls._fp('chat_bot_docu')
-
-    def _handle_text_chunk(self, link: str, txt: str, log_handler: Callable[[str, dict], None] | None = None):
-        fn = self._make_file_name(link)
-        file_path = os.path.join(self.docu_root(), fn)
-        txt = self._prepare_text(txt)
-        with open(file_path, 'w+') as f:
-            f.write(txt)
-        self._docu_links.append(file_path)
-        log_handler and log_handler('links-meta', {'text': f"{file_path} (Length {len(txt)})"})
-        return [txt]
-
-    def _handle_long_text_chunk(self, link: str, text: str, log_handler: Callable[[str, dict], None] | None = None):  #
+    def docu_root(self) -> str:
+        if self._root:
+            return self._root
+        if self.corpus == DEFAULT_CORPUS:
+            return self._fp('chat_bot_docu')
+        return self._fp(os.path.join('chat_bot_corpora', self.corpus))
+
+    @staticmethod
+    def _write_chunk(writer: ChunkWriter, link: str, chunk: dict, seq: int, header: str, txt: str,
+                     span: tuple[int, int], log_handler: Callable[[str, dict], None] | None = None,
+                     link_idx: int | None = None):
+        writer.add(chunk['id'], txt, link, header, seq, span)
+        log_handler and log_handler('links-meta', {'text': f"{link} #{seq} (Length {len(txt)})", 'id': chunk['id'],
+                                                   'idx': link_idx})
+
+    def _split_text(self, text: str) -> list[tuple[str, str, tuple[int, int]]]:
+        """
+        Splits the text of a page into chunks and returns them as (section header, raw chunk text,
+        span). The span is the (start, end) of the chunk within the section buffers of the page laid
+        end to end, so the spans of overlapping chunks overlap, however the LLM rewrites their text.
+        """
         main_header = text.split('\n')[0]
+        if len(text) <= self._chunk_size:
+            return [(main_header, text, (0, len(text)))]
         text_chunks = []
-        new_text = main_header
+        new_text, header, base = main_header, None, 0
         sub_sections = re.split(r'\n## ', text)
         for idx, text_part in enumerate(sub_sections):
             new_text += '\n## ' + text_part.strip('#')
+            header = header or (main_header if idx == 0 else text_part.split('\n')[0].strip('# '))
 
             if len(sub_sections) - 1 == idx or len(new_text) > self._chunk_size:
                 chunk_idx = 0
                 chunk_step = int(self._chunk_size * 1.2 // 1)
                 while chunk_idx < len(new_text):
-                    fn = self._make_file_name(link, f"{idx}_{chunk_idx // self._chunk_size}")
-                    chunk_end = chunk_idx + chunk_step
-                    text_chunks += self._handle_text_chunk(fn, new_text[chunk_idx:chunk_end], log_handler)
+                    chunk_end = min(chunk_idx + chunk_step, len(new_text))
+                    text_chunks.append((header, new_text[chunk_idx:chunk_end], (base + chunk_idx, base + chunk_end)))
                     chunk_idx += self._chunk_size
-                new_text = main_header
+                base += len(new_text)
+                new_text, header = main_header, None
 
         return text_chunks
 
-    def fetch_documents(self, log_handler: Callable[[str, dict], None] | None = None):
-        links = self._get_all_website_links()
-        if os.path.isdir(self.docu_root()):
-            shutil.rmtree(self.docu_root())
-        os.makedirs(self.docu_root(), exist_ok=True)
-        index = {'links': self._docu_links}
+    def _diff_page_chunks(self, manifest: Manifest, text: str, known: dict | None) -> tuple:
+        """
+        Re-chunks a new or changed page. Chunks whose raw text is unchanged keep their id, only the
+        others need to run through _prepare_text. Returns the page's chunks, their spans, the new
+        chunks with their position, section header, raw text and span and the dropped chunks.
+        """
+        old_chunks = {}
+        for chunk in known['chunks'] if known else []:
+            old_chunks.setdefault(chunk['hash'], chunk)
+        chunks, spans, new_chunks = [], [], []
+        for seq, (header, raw_text, span) in enumerate(self._split_text(text)):
+            raw_hash = content_hash(raw_text)
+            chunk = old_chunks.pop(raw_hash, None)
+            if chunk is None:
+                chunk = {'id': manifest.allocate_id(), 'hash': raw_hash}
+                new_chunks.append((chunk, seq, header, raw_text, span))
+            chunks.append(chunk)
+            spans.append(span)
+        return chunks, spans, new_chunks, list(old_chunks.values())
+
+    def fetch_documents(self, log_handler: Callable[[str, dict], None] | None = None, incremental: bool = False,
+                        job_context: JobContext | None = None):
+        with span('ingest.total', log_handler):
+            self._fetch_documents(log_handler, incremental, job_context)
+
+    def _fetch_documents(self, log_handler: Callable[[str, dict], None] | None, incremental: bool,
+                         job_context: JobContext | None):
+        """
+        Fetches the documentation and (re)builds the chunks and the FAISS index.
+
+        Pages stream through the stages extract -> chunk -> prepare -> write -> embed, connected by
+        bounded queues. The LLM bound prepare stage runs PREPARE_CONCURRENCY chunks in parallel, so a
+        multi-slot ollama server (OLLAMA_NUM_PARALLEL) is kept busy. Progress events arrive in
+        completion order; 'links' events carry the page idx, 'links-meta' events the page idx and
+        the chunk id.
+
+        Run as a job, the prepared text of every chunk is checkpointed, so a resumed job only sends
+        the chunks to the LLM that were not finished before.
+
+        A full rebuild is written to a staging directory and swapped in once it is complete, so the
+        old corpus is served until then and a failed or cancelled rebuild leaves it untouched.
+        """
+        manifest = Manifest.load(self.docu_root()) if incremental else None
+        if manifest is not None and not has_chunk_store(self.docu_root()):
+            migrate_legacy_layout(self.docu_root())
+        if manifest is not None and not (os.path.exists(os.path.join(self.docu_root(), INDEX_FILE_NAME))
+                                         and has_chunk_store(self.docu_root())):
+            manifest = None
+        with span('ingest.crawl', log_handler):
+            links = self._get_all_website_links(manifest)
+        if manifest is None:
+            manifest = Manifest(stage_root(self.docu_root()))
+            try:
+                self._ingest(log_handler, links, manifest, manifest.root, job_context)
+            except BaseException:
+                shutil.rmtree(manifest.root, ignore_errors=True)
+                raise
+            swap_root(manifest.root, self.docu_root())
+        else:
+            self._ingest(log_handler, links, manifest, self.docu_root(), job_context)
+        log_handler and log_handler(f'chunks_path', {'text': self.docu_root()})
+        self._pages = {}
+        self._log_llm_cache_stats(log_handler)
+
+    def _ingest(self, log_handler: Callable[[str, dict], None] | None, links: list[str], manifest: Manifest,
+                root: str, job_context: JobContext | None):
+        writer = ChunkWriter(root, rebuild=len(manifest.pages) == 0)
         log_handler and log_handler('meta', {'len': str(len(links))})
-        text_chunks = []
-        for _idx, link in enumerate(links):
-            text = self._extract_text_from_web(link)
+        job_context and job_context.set_total(len(links))
+        old_pages, manifest.pages = manifest.pages, {}
+        removed_ids = []
+
+        def extract(job):
+            job_context and job_context.check_cancelled()
+            try:
+                return extract_page(job)
+            finally:
+                job_context and job_context.advance()
+
+        def extract_page(job):
+            _idx, link = job
+            page, known = self._pages.get(link), old_pages.get(link)
+            if known is not None and page.not_modified:
+                log_handler and log_handler('links', {'text': f'[{_idx + 1}/{len(links)}] {link} (Not modified)',
+                                                      'idx': _idx})
+                manifest.pages[link] = known
+                return []
+            with span('ingest.extract'):
+                text = self._extract_text_from_web(link)
             log_handler and log_handler('links', {'text': f'[{_idx + 1}/{len(links)}] {link} (Lenght: {len(text)})',
                                                   'idx': _idx})
-            if len(text) > self._chunk_size:
-                text_chunks += self._handle_long_text_chunk(link, text, log_handler)
-            else:
-                text_chunks += self._handle_text_chunk(link, text, log_handler)
+            entry = {'etag': page.etag, 'last_modified': page.last_modified, 'links': page.links,
+                     'hash': content_hash(text)}
+            if known is not None and known['hash'] == entry['hash']:
+                manifest.pages[link] = known | entry
+                return []
+            return [(_idx, link, text, known, entry)]
+
+        def chunk(job):
+            _idx, link, text, known, entry = job
+            chunks, spans, new_chunks, removed_chunks = self._diff_page_chunks(manifest, text, known)
+            writer.remove([c['id'] for c in removed_chunks])
+            removed_ids.extend(c['id'] for c in removed_chunks)
+            new_ids = {new_chunk['id'] for new_chunk, *_ in new_chunks}
+            for seq, (kept_chunk, span) in enumerate(zip(chunks, spans)):
+                if kept_chunk['id'] not in new_ids:
+                    writer.move(kept_chunk['id'], seq, span)
+            manifest.pages[link] = entry | {'chunks': chunks}
+            return [(_idx, link, *new_chunk) for new_chunk in new_chunks]
+
+        def prepare(job):
+            _idx, link, new_chunk, seq, header, raw_text, span = job
+            job_context and job_context.check_cancelled()
+            return [(_idx, link, new_chunk, seq, header,
+                     self._checkpointed(job_context, 'prepare', raw_text, self._prepare_text), span)]
+
+        def write(job):
+            _idx, link, new_chunk, seq, header, txt, span = job
+            self._write_chunk(writer, link, new_chunk, seq, header, txt, span, log_handler, _idx)
+            return [(new_chunk, txt)]
+
+        embed_batch, embed_batch_size = [], int(os.getenv('EMBED_BATCH_SIZE', 64))
+
+        def embed_flush():
+            if not embed_batch:
+                return []
+            ids = [new_chunk['id'] for new_chunk, _ in embed_batch]
+            with span('ingest.embed'):
+                embeddings = self._embed([txt for _, txt in embed_batch])
+            embed_batch.clear()
+            return [(ids, embeddings)]
+
+        def embed(job):
+            embed_batch.append(job)
+            return embed_flush() if len(embed_batch) >= embed_batch_size else []
+
+        pipeline = Pipeline([
+            Stage('extract', extract, int(os.getenv('EXTRACT_CONCURRENCY', 4))),
+            Stage('chunk', chunk),
+            Stage('prepare', prepare, int(os.getenv('PREPARE_CONCURRENCY', 4))),
+            Stage('write', write),
+            Stage('embed', embed, flush=embed_flush),
+        ], int(os.getenv('PIPELINE_QUEUE_SIZE', 32)))
+        try:
+            embedded = pipeline.run(enumerate(links))
+        except BaseException:
+            writer.abort()
+            raise
+        added_ids = [chunk_id for ids, _ in embedded for chunk_id in ids]
+        embeddings = np.concatenate([e for _, e in embedded]) if embedded else None
+
+        manifest.pages = {link: manifest.pages[link] for link in links if link in manifest.pages}
+        for link, known in old_pages.items():
+            if link not in manifest.pages:
+                removed_ids += [chunk['id'] for chunk in known['chunks']]
+        writer.remove(removed_ids)
+        # The chunk store is complete before the index generation that refers to its ids is bumped
+        writer.commit()
+        with span('ingest.index', log_handler):
+            if len(old_pages) == 0:
+                params = IndexParams.from_env()
+                self._write_index(log_handler, params.build(embeddings, added_ids), params, root)
+            elif added_ids or removed_ids:
+                self._update_index(log_handler, embeddings, added_ids, removed_ids)
+        # Only compacted once the index generation without the removed ids is published
+        if ChunkReader(root).fragmentation() > float(os.getenv('CHUNK_STORE_MAX_FRAGMENTATION', 0.5)):
+            compact(root)
+        manifest.save()
 
-        with open(os.path.join(self.docu_root(), 'index.json'), 'w+') as f:
-            f.write(json.dumps(index))
-        log_handler and log_handler(f'chunks_path', {'text': self.docu_root()})
-        self._index_chunks(log_handler, text_chunks)
-
-    def index_chunks(self, log_handler):
-        text_chunks = []
-        for dl in self.get_document_links():
-            with open(dl, 'r') as f:
-                text_chunks.append(f.read())
-        self._index_chunks(log_handler, text_chunks)
-
-    def generate_questions(self, log_handler):
+    @staticmethod
+    def _log_llm_cache_stats(log_handler: Callable[[str, dict], None] | None):
+        llm_cache = get_llm_cache()
+        if llm_cache is not None and log_handler:
+            stats = llm_cache.stats()
+            log_handler('llm-cache', stats | {'text': f"LLM cache hits: {stats['hits']}, misses: {stats['misses']}, "
+                                                      f"entries: {stats['entries']}"})
+
+    def index_chunks(self, log_handler, job_context: JobContext | None = None):
+        chunks = self.get_chunks()
+        ids = chunks.ids()
+        job_context and job_context.set_total(len(ids))
+        self._index_chunks(log_handler, [chunks[chunk_id] for chunk_id in ids], ids)
+        job_context and job_context.advance(len(ids))
+
+    def document_embeddings(self):
+        chunks = self.get_chunks()
+        return self._embed([chunks[chunk_id] for chunk_id in chunks.ids()])
+
+    def generate_questions(self, log_handler, job_context: JobContext | None = None):
         q_root = os.path.join(self.docu_root(), 'questions')
         shutil.rmtree(q_root, ignore_errors=True)
         os.makedirs(q_root, exist_ok=True)
-        for dl in self.get_document_links():
-            log_handler and log_handler(f'generate_questions', {'text': f'Generateing questions for: {dl}'})
-            with open(dl, 'r') as f:
-                question_chunk = self._generate_questions(f.read())
+        chunks = self.get_chunks()
+        job_context and job_context.set_total(len(chunks))
+        for chunk_id in chunks.ids():
+            job_context and job_context.check_cancelled()
+            meta = chunks.meta(chunk_id)
+            log_handler and log_handler(f'generate_questions', {'text': f"Generateing questions for: {meta['url']} "
+                                                                        f"#{meta['seq']} (id {chunk_id})"})
+            question_chunk = self._checkpointed(job_context, 'questions', chunks[chunk_id], self._generate_questions)
+            job_context and job_context.advance()
             log_handler and log_handler(f'generated_questions', {'text': question_chunk})
-            q_file_path = os.path.join(q_root, os.path.basename(dl))
+            q_file_path = os.path.join(q_root, f'{chunk_id}.txt')
             with open(q_file_path, 'w+') as f:
                 f.write(question_chunk)
+        self.index_questions(log_handler, job_context)
+        self._log_llm_cache_stats(log_handler)
 
 
 
-    def get_document_links(self):
-        if len(self._docu_links) == 0:
-            json_path = os.path.join(self.docu_root(), 'index.json')
-            if os.path.exists(json_path):
-                with open(json_path, 'r') as f:
-                    self._docu_links = json.loads(f.read())['links']
-            else:
-                self.fetch_documents()
-        return self._docu_links
+    def index_questions(self, log_handler, job_context: JobContext | None = None):
+        """
+        Parses the generated questions into question / answer records and indexes the questions, so
+        user questions are matched against them (see query_ollama.prepare_answer).
+        """
+        q_root = os.path.join(self.docu_root(), 'questions')
+        records = []
+        for file_name in sorted(os.listdir(q_root)) if os.path.isdir(q_root) else []:
+            chunk_id, ext = os.path.splitext(file_name)
+            if ext != '.txt' or not chunk_id.isdigit():
+                continue
+            with open(os.path.join(q_root, file_name), 'r') as f:
+                records += [{'question': question, 'answer': answer, 'chunk_id': int(chunk_id)}
+                            for question, answer in parse_qa_pairs(f.read())]
+        if not records:
+            # Drop a Q&A index of earlier questions, it would answer with outdated answers
+            for file_name in (QA_INDEX_FILE_NAME, QA_RECORDS_FILE_NAME):
+                if os.path.exists(os.path.join(self.docu_root(), file_name)):
+                    os.remove(os.path.join(self.docu_root(), file_name))
+            log_handler and log_handler('index', {'text': f'No generated questions found in {q_root}'})
+            return
+        batch_size = int(os.getenv('EMBED_BATCH_SIZE', 64))
+        embeddings = []
+        with span('ingest.embed_questions', log_handler):
+            for start in range(0, len(records), batch_size):
+                job_context and job_context.check_cancelled()
+                embeddings.append(self._embed([record['question'] for record in records[start:start + batch_size]]))
+        QAIndex.build(records, np.concatenate(embeddings)).save(self.docu_root())
+        bump_generation(self.docu_root())
+        qa_path = os.path.join(self.docu_root(), QA_INDEX_FILE_NAME)
+        log_handler and log_handler('index', {'text': f'Q&A index path {qa_path} ({len(records)} questions)'})
+
+    def get_chunks(self) -> ChunkReader:
+        if not has_chunk_store(self.docu_root()):
+            migrate_legacy_layout(self.docu_root())
+        if not has_chunk_store(self.docu_root()):
+            self.fetch_documents()
+        return ChunkReader(self.docu_root())
+
+    def get_retrieval_store(self) -> RetrievalStore:
+        self._touch()
+        retrieval_store = self._retrieval_store
+        if retrieval_store is None:
+            retrieval_store = self._retrieval_store = RetrievalStore(self.docu_root())
+        return retrieval_store
+
+    def get_query_batcher(self) -> QueryBatcher:
+        if self._query_batcher is None:
+            self._query_batcher = QueryBatcher(self.get_embedding_model, lambda: self.get_retrieval_store().snapshot())
+        return self._query_batcher
+
+    def get_answer_cache(self) -> SemanticAnswerCache | None:
+        if os.getenv('ANSWER_CACHE', 'true').lower() != 'true':
+            return None
+        answer_cache = self._answer_cache
+        if answer_cache is None:
+            answer_cache = self._answer_cache = SemanticAnswerCache(
+                lambda: self.get_retrieval_store().snapshot().generation)
+        return answer_cache
 
     def get_embedding_model(self):
-        if self._embedding_model is None:
-            self._embedding_model = SentenceTransformer(self._embedding_model_name)
-        return self._embedding_model
-
-    def _index_chunks(self, log_handler, text_chunks):
+        return get_shared_embedding_model(self._embedding_model_name)
+
+    def warm_up(self) -> bool:
+        """
+        Loads the embedding model, runs a first encode and loads the current index generation, so the
+        first request does not pay for it. Returns whether an index was found.
+        """
+        with span('warm_up'):
+            self.get_embedding_model().encode(['warm up'])
+            if not os.path.exists(os.path.join(self.docu_root(), INDEX_FILE_NAME)):
+                return False
+            self.get_retrieval_store().snapshot()
+            return True
+
+    def is_ready(self) -> bool:
+        """Whether /chat can be answered without loading the embedding model first."""
+        if self._embedding_model_name not in _embedding_models or \
+                not os.path.exists(os.path.join(self.docu_root(), INDEX_FILE_NAME)):
+            return False
+        # Loads an index that only appeared after the warm up
+        return self.get_retrieval_store().snapshot() is not None
+
+    def _embed(self, text_chunks: list[str]):
         # Load pre-trained model
         model = self.get_embedding_model()  # Lightweight and efficient
         # Generate embeddings
-        embeddings = model.encode(text_chunks, convert_to_tensor=True)
+        embeddings = run_blocking(model.encode, text_chunks, convert_to_tensor=True)
         # Convert embeddings to numpy array
-        embeddings_np = embeddings.cpu().detach().numpy()
-        # Create a FAISS index
-        dimension = embeddings_np.shape[1]
-        index = faiss.IndexFlatL2(dimension)  # L2 distance (Euclidean)
-        index.add(embeddings_np)
-        # Save the index for later use
-        idx_bin_path = os.path.join(self.docu_root(), "faiss_index.bin")
-        faiss.write_index(index, idx_bin_path)
-        log_handler and log_handler(f'index', {'text': f'FAISS index path {idx_bin_path}'})
+        return embeddings.cpu().detach().numpy()
+
+    def _write_index(self, log_handler, index, params: IndexParams, root: str | None = None):
+        # Save the index for later use. Writing to a temp file first keeps running workers from
+        # reading a half written index; the generation bump makes them swap to the new one.
+        root = root or self.docu_root()
+        idx_bin_path = os.path.join(root, INDEX_FILE_NAME)
+        faiss.write_index(index, idx_bin_path + '.tmp')
+        os.replace(idx_bin_path + '.tmp', idx_bin_path)
+        params.save(root)
+        self._write_lexical_index(log_handler, root)
+        bump_generation(root)
+        log_handler and log_handler(f'index', {'text': f'FAISS {params.kind} index path {idx_bin_path}'})
+
+    def _write_lexical_index(self, log_handler, root: str):
+        # Rebuilt from the committed chunk store, so it always covers the same ids as the FAISS index
+        chunks = ChunkReader(root) if root != self.docu_root() else self.get_chunks()
+        ids = chunks.ids()
+        BM25Index.build(ids, (chunks[chunk_id] for chunk_id in ids)).save(root)
+        lexical_path = os.path.join(root, LEXICAL_INDEX_FILE_NAME)
+        log_handler and log_handler(f'index', {'text': f'BM25 index path {lexical_path}'})
+
+    def _index_chunks(self, log_handler, text_chunks, ids: list[int]):
+        params = IndexParams.from_env()
+        self._write_index(log_handler, params.build(self._embed(text_chunks), ids), params)
+
+    def _update_index(self, log_handler, embeddings_np, added_ids: list[int], removed_ids: list[int]):
+        """Removes and adds only the vectors of changed chunks instead of re-embedding the corpus."""
+        index = faiss.read_index(os.path.join(self.docu_root(), INDEX_FILE_NAME))
+        params = IndexParams.load(self.docu_root())
+        if not params.has_ids(index):
+            # Indexes written before chunk ids existed can only be rebuilt
+            return self.index_chunks(log_handler)
+        if removed_ids and not params.supports_remove:
+            # HNSW graphs cannot drop vectors, rebuild them from the stored vectors instead of re-embedding
+            removed = set(removed_ids)
+            kept_ids = [i for i in faiss.vector_to_array(index.id_map).tolist() if i not in removed]
+            kept = np.array([index.reconstruct(i) for i in kept_ids], dtype=np.float32).reshape(-1, index.d)
+            if added_ids:
+                kept_ids, kept = kept_ids + added_ids, np.concatenate([kept, params.prepare(embeddings_np)])
+            return self._write_index(log_handler, params.build(kept, kept_ids), params)
+        if removed_ids:
+            index.remove_ids(np.array(removed_ids, dtype=np.int64))
+        if added_ids:
+            index.add_with_ids(params.prepare(embeddings_np), np.array(added_ids, dtype=np.int64))
+        self._write_index(log_handler, index, params)
+
+    def _ask_llm(self, template: str, prompt: str) -> str:
+        with span(f'llm.{template}'):
+            return query_ollama(prompt, self._llm, False, f'{PROMPT_TEMPLATE_VERSION}:{template}')['answer']
+
+    def _checkpointed(self, job_context: JobContext | None, step: str, text: str, func: Callable[[str], str]) -> str:
+        """func(text), taken from the checkpoints of the job if an earlier attempt already computed it."""
+        if job_context is None:
+            return func(text)
+        key = f'{step}:{self._llm}:{PROMPT_TEMPLATE_VERSION}:{content_hash(text)}'
+        result = job_context.checkpoint(key)
+        if result is None:
+            result = func(text)
+            job_context.save_checkpoint(key, result)
+        return result
 
     def _prepare_text(self, text: str) -> str:
         if os.getenv('ONLY_SAMPLE_ANSWER', 'f').lower() == 'true':
             return text
         prompt = f"The following text is the documentation chunk for the Chemotion ELN. Summarize the following text into a concise, high-quality text while retaining key details: {text}"
-        text = query_ollama(prompt, self._llm, False)['answer']
+        text = self._ask_llm('summarize', prompt)
         prompt = f"Rewrite the following text to be scientifically sound such that it give a clear information to its reader: {text}"
-        text = query_ollama(prompt, self._llm, False)['answer']
+        text = self._ask_llm('rewrite', prompt)
         prompt = f"Does the following text need more context or additional details? If yes, suggest improvements: {text}"
-        text = query_ollama(prompt, self._llm, False)['answer']
+        text = self._ask_llm('context', prompt)
         prompt = f"Eliminate redundant information from the following text while preserving meaning: {text}"
-        text = query_ollama(prompt, self._llm, False)['answer']
+        text = self._ask_llm('deduplicate', prompt)
         prompt = f"Include missing domain knowledge: {text}"
-        return query_ollama(prompt, self._llm, False)['answer']
+        return self._ask_llm('domain', prompt)
 
     def _generate_questions(self, text: str) -> str:
         if os.getenv('ONLY_SAMPLE_ANSWER', 'f').lower() == 'true':
@@ -235,4 +616,4 @@ class ContextManager(metaclass=ThreadSafeSingleton):
         # "Generate a list of 10 realistic questions that a user of the Chemotion ELN system might ask based on this documentation.\nFor each question:\n1. Ensure it reflects practical, system-related scenarios.\n2.Provide a clear, accurate, and concise answer that an IT support staff member would typically deliver to address the query.\nMake the questions user-focused and answers professional yet accessible to someone with basic technical knowledge.\n Using the provided Chemotion ELN documentation excerpt:{context}"
 
         prompt = f"Based on the provided Chemotion ELN documentation chunk:\n\n<context>\n\n {text} \n\n</context>\n\n, generate a list of 10 realistic questions that a system user might ask. For each question, provide a clear, accurate, and concise answer that an IT support staff member would typically give in response."
-        return query_ollama(prompt, self._llm)['answer']
+        return self._ask_llm('questions', prompt)
@@ -0,0 +1,58 @@
+import time
+
+import faiss
+import numpy as np
+
+from ChatBotProxy.main_engine.index_factory import IndexParams, INDEX_TYPES
+
+
+def synthetic_embeddings(n: int, dimension: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """Clustered random vectors, a stand-in for large corpora when benchmarking index types."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    return (centers[labels] + 0.3 * rng.normal(size=(n, dimension))).astype(np.float32)
+
+
+def sample_queries(embeddings: np.ndarray, n: int, noise: float = 0.1, seed: int = 1) -> np.ndarray:
+    """Perturbed corpus vectors, so every query has true neighbours in the corpus."""
+    rng = np.random.default_rng(seed)
+    picked = embeddings[rng.integers(0, len(embeddings), n)]
+    scale = noise * float(np.std(embeddings))
+    return (picked + scale * rng.normal(size=picked.shape)).astype(np.float32)
+
+
+def run_index_bench(embeddings: np.ndarray, queries: np.ndarray, k: int = 10, kinds: tuple = INDEX_TYPES,
+                    metric: str = 'l2') -> list[dict]:
+    """
+    Builds every index type on the same embeddings and reports build time, serialized size, single
+    query latency (p50/p99, ms) and recall@k against an exhaustive flat index with the same metric.
+    """
+    ids = np.arange(len(embeddings), dtype=np.int64)
+    baseline = IndexParams('flat', metric)
+    _, truth = baseline.build(embeddings, ids).search(baseline.prepare(queries), k)
+    results = []
+    for kind in kinds:
+        params = IndexParams.from_env(kind=kind, metric=metric)
+        start = time.perf_counter()
+        index = params.build(embeddings, ids)
+        build_time = time.perf_counter() - start
+        prepared = params.prepare(queries)
+        latencies, found = [], []
+        for query in prepared:
+            start = time.perf_counter()
+            _, indices = index.search(query.reshape(1, -1), k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append(indices[0])
+        recall = np.mean([len(set(f[f >= 0]) & set(t)) / k for f, t in zip(found, truth)])
+        results.append({
+            'type': kind,
+            'metric': metric,
+            'vectors': len(embeddings),
+            'build_s': round(build_time, 4),
+            'memory_mb': round(faiss.serialize_index(index).nbytes / 1024 / 1024, 3),
+            'latency_p50_ms': round(float(np.percentile(latencies, 50)), 4),
+            'latency_p99_ms': round(float(np.percentile(latencies, 99)), 4),
+            f'recall@{k}': round(float(recall), 4),
+        })
+    return results
@@ -0,0 +1,126 @@
+import json
+import math
+import os
+
+import faiss
+import numpy as np
+
+INDEX_PARAMS_FILE_NAME = 'index_params.json'
+INDEX_TYPES = ('flat', 'ivf_flat', 'hnsw', 'ivf_pq')
+INDEX_METRICS = ('l2', 'ip', 'cosine')
+
+
+class IndexParams:
+    """
+    Build and search parameters of a FAISS index. They are persisted next to the index, so the
+    search side (nprobe, efSearch, query normalization) always matches how the index was built.
+    """
+
+    def __init__(self, kind: str = 'flat', metric: str = 'l2', nlist: int = 0, nprobe: int = 8, hnsw_m: int = 32,
+                 ef_construction: int = 200, ef_search: int = 64, pq_m: int = 0, pq_nbits: int = 8):
+        if kind not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type {kind}, use one of {', '.join(INDEX_TYPES)}")
+        if metric not in INDEX_METRICS:
+            raise ValueError(f"Unknown index metric {metric}, use one of {', '.join(INDEX_METRICS)}")
+        self.kind, self.metric = kind, metric
+        self.nlist, self.nprobe = nlist, nprobe
+        self.hnsw_m, self.ef_construction, self.ef_search = hnsw_m, ef_construction, ef_search
+        self.pq_m, self.pq_nbits = pq_m, pq_nbits
+
+    @classmethod
+    def from_env(cls, **overrides) -> 'IndexParams':
+        params = {
+            'kind': os.getenv('INDEX_TYPE', 'flat').lower(),
+            'metric': os.getenv('INDEX_METRIC', 'l2').lower(),
+            'nlist': int(os.getenv('INDEX_NLIST', 0)),
+            'nprobe': int(os.getenv('INDEX_NPROBE', 8)),
+            'hnsw_m': int(os.getenv('INDEX_HNSW_M', 32)),
+            'ef_construction': int(os.getenv('INDEX_EF_CONSTRUCTION', 200)),
+            'ef_search': int(os.getenv('INDEX_EF_SEARCH', 64)),
+            'pq_m': int(os.getenv('INDEX_PQ_M', 0)),
+            'pq_nbits': int(os.getenv('INDEX_PQ_NBITS', 8)),
+        }
+        return cls(**(params | overrides))
+
+    @classmethod
+    def load(cls, root: str) -> 'IndexParams':
+        path = os.path.join(root, INDEX_PARAMS_FILE_NAME)
+        if not os.path.exists(path):
+            # Indexes written before the parameters were persisted are flat L2 indexes
+            return cls()
+        with open(path, 'r') as f:
+            return cls(**json.loads(f.read()))
+
+    def save(self, root: str):
+        path = os.path.join(root, INDEX_PARAMS_FILE_NAME)
+        with open(path + '.tmp', 'w+') as f:
+            f.write(json.dumps(vars(self)))
+        os.replace(path + '.tmp', path)
+
+    @property
+    def faiss_metric(self) -> int:
+        return faiss.METRIC_L2 if self.metric == 'l2' else faiss.METRIC_INNER_PRODUCT
+
+    @property
+    def supports_remove(self) -> bool:
+        return self.kind != 'hnsw'
+
+    def prepare(self, embeddings: np.ndarray) -> np.ndarray:
+        """Converts embeddings (corpus or queries) into the form the index expects."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if self.metric == 'cosine':
+            embeddings = embeddings.copy()
+            faiss.normalize_L2(embeddings)
+        return embeddings
+
+    def _nlist(self, n: int) -> int:
+        # FAISS wants ~39 training points per centroid
+        if self.nlist > 0:
+            return max(1, min(self.nlist, n))
+        return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+    def _pq_m(self, dimension: int) -> int:
+        if self.pq_m > 0:
+            return self.pq_m
+        return next(m for m in (64, 48, 32, 24, 16, 12, 8, 6, 4, 3, 2, 1) if dimension % m == 0 and m <= dimension)
+
+    @property
+    def native_ids(self) -> bool:
+        # IVF indexes store arbitrary ids themselves and, unlike an IndexIDMap around them, can remove them
+        return self.kind in ('ivf_flat', 'ivf_pq')
+
+    def has_ids(self, index) -> bool:
+        return self.native_ids or isinstance(index, faiss.IndexIDMap2)
+
+    def build(self, embeddings: np.ndarray, ids):
+        """Creates, trains (IVF types) and fills an index of this kind, addressable by the given ids."""
+        embeddings = self.prepare(embeddings)
+        n, dimension = embeddings.shape
+        if self.kind == 'flat':
+            index = faiss.IndexFlat(dimension, self.faiss_metric)
+        elif self.kind == 'hnsw':
+            index = faiss.IndexHNSWFlat(dimension, self.hnsw_m, self.faiss_metric)
+            index.hnsw.efConstruction = self.ef_construction
+        else:
+            quantizer = faiss.IndexFlat(dimension, self.faiss_metric)
+            if self.kind == 'ivf_flat':
+                index = faiss.IndexIVFFlat(quantizer, dimension, self._nlist(n), self.faiss_metric)
+            else:
+                # Every PQ sub-quantizer needs at least 2^nbits training points
+                nbits = max(1, min(self.pq_nbits, int(math.log2(max(n, 2)))))
+                index = faiss.IndexIVFPQ(quantizer, dimension, self._nlist(n), self._pq_m(dimension), nbits,
+                                         self.faiss_metric)
+            index.train(embeddings)
+        if not self.native_ids:
+            index = faiss.IndexIDMap2(index)
+        index.add_with_ids(embeddings, np.asarray(ids, dtype=np.int64))
+        self.apply(index)
+        return index
+
+    def apply(self, index):
+        """Sets the search time parameters on a built or loaded index."""
+        base = faiss.downcast_index(index.index if isinstance(index, faiss.IndexIDMap) else index)
+        if self.kind in ('ivf_flat', 'ivf_pq'):
+            faiss.extract_index_ivf(base).nprobe = self.nprobe
+        elif self.kind == 'hnsw':
+            base.hnsw.efSearch = self.ef_search
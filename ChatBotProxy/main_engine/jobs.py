@@ -0,0 +1,316 @@
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable
+
+from ChatBotProxy.main_engine.utils import start_thread
+
+ACTIVE_STATES = ('queued', 'running')
+
+_COLUMNS = ('id', 'kind', 'corpus', 'root', 'params', 'status', 'done', 'total', 'message', 'error', 'attempts', 'pid',
+            'cancel_requested', 'created', 'started', 'finished')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def try_lock_corpus(root: str):
+    """
+    Takes the cross-process lock of the corpus stored in root without waiting. Returns the open lock
+    file (closing it releases the lock, so does the death of the process) or None if it is held.
+    """
+    os.makedirs(os.path.dirname(root), exist_ok=True)
+    lock = open(root + '.lock', 'a+')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+
+class JobStore:
+    """
+    SQLite table of the background jobs (update, index_chunks, generate_questions, index_questions)
+    shared by all processes, plus the checkpoints of unfinished jobs. At most one job per corpus is
+    active.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                           'id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, corpus TEXT NOT NULL, '
+                           'root TEXT NOT NULL, params TEXT NOT NULL, status TEXT NOT NULL, '
+                           'done INTEGER NOT NULL DEFAULT 0, total INTEGER NOT NULL DEFAULT 0, message TEXT, '
+                           'error TEXT, attempts INTEGER NOT NULL DEFAULT 0, pid INTEGER, '
+                           'cancel_requested INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL, started REAL, '
+                           'finished REAL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS checkpoints ('
+                           'corpus TEXT NOT NULL, kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+                           'PRIMARY KEY (corpus, kind, key))')
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        job = dict(zip(_COLUMNS, row))
+        job['params'] = json.loads(job['params'])
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        return job
+
+    def _select(self, where: str = '', args: tuple = (), suffix: str = '') -> list[dict]:
+        rows = self._conn.execute(f'SELECT {", ".join(_COLUMNS)} FROM jobs {where} {suffix}', args).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def create(self, kind: str, corpus: str, root: str, params: dict) -> tuple[dict, bool]:
+        """Queues a job unless the corpus already has an active one. Returns (job, created)."""
+        retention = float(os.getenv('JOB_RETENTION_DAYS', 30)) * 86400
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                active = self._select('WHERE corpus = ? AND status IN (?, ?)', (corpus, *ACTIVE_STATES))
+                if active:
+                    self._conn.execute('COMMIT')
+                    return active[0], False
+                self._conn.execute('DELETE FROM jobs WHERE finished < ?', (time.time() - retention,))
+                job_id = self._conn.execute('INSERT INTO jobs (kind, corpus, root, params, status, created) '
+                                            'VALUES (?, ?, ?, ?, ?, ?)',
+                                            (kind, corpus, root, json.dumps(params), 'queued', time.time())).lastrowid
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return self.get(job_id), True
+
+    def get(self, job_id: int) -> dict | None:
+        with self._lock:
+            jobs = self._select('WHERE id = ?', (job_id,))
+        return jobs[0] if jobs else None
+
+    def recent(self, corpus: str | None = None, limit: int = 50) -> list[dict]:
+        with self._lock:
+            if corpus is None:
+                return self._select(suffix='ORDER BY id DESC LIMIT ?', args=(limit,))
+            return self._select('WHERE corpus = ?', (corpus, limit), 'ORDER BY id DESC LIMIT ?')
+
+    def runnable(self) -> list[dict]:
+        """Queued jobs and running ones, which are orphaned if nobody holds the corpus lock."""
+        with self._lock:
+            return self._select('WHERE status IN (?, ?)', ACTIVE_STATES, 'ORDER BY id')
+
+    def claim(self, job_id: int) -> bool:
+        with self._lock:
+            return self._conn.execute('UPDATE jobs SET status = ?, pid = ?, attempts = attempts + 1, '
+                                      'started = COALESCE(started, ?) '
+                                      'WHERE id = ? AND status IN (?, ?) AND cancel_requested = 0',
+                                      ('running', os.getpid(), time.time(), job_id, *ACTIVE_STATES)).rowcount == 1
+
+    def update_progress(self, job_id: int, done: int, total: int, message: str | None):
+        with self._lock:
+            self._conn.execute('UPDATE jobs SET done = ?, total = ?, message = ? WHERE id = ?',
+                               (done, total, message, job_id))
+
+    def finish(self, job_id: int, status: str, error: str | None = None):
+        with self._lock:
+            self._conn.execute('UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?',
+                               (status, error, time.time(), job_id))
+
+    def request_cancel(self, job_id: int) -> dict | None:
+        """Cancels a queued job at once; a running job stops at its next cancellation check."""
+        with self._lock:
+            self._conn.execute('UPDATE jobs SET status = ?, finished = ? WHERE id = ? AND status = ?',
+                               ('cancelled', time.time(), job_id, 'queued'))
+            self._conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?', (job_id, 'running'))
+        return self.get(job_id)
+
+    def is_cancel_requested(self, job_id: int) -> bool:
+        with self._lock:
+            row = self._conn.execute('SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def get_checkpoint(self, corpus: str, kind: str, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM checkpoints WHERE corpus = ? AND kind = ? AND key = ?',
+                                     (corpus, kind, key)).fetchone()
+        return row and row[0]
+
+    def put_checkpoint(self, corpus: str, kind: str, key: str, value: str):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO checkpoints (corpus, kind, key, value) VALUES (?, ?, ?, ?)',
+                               (corpus, kind, key, value))
+
+    def clear_checkpoints(self, corpus: str, kind: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM checkpoints WHERE corpus = ? AND kind = ?', (corpus, kind))
+
+
+class JobContext:
+    """
+    Handed to a running job: reports progress, answers whether the job was cancelled and keeps
+    checkpoints of finished work items, which a resumed or retried job of the same kind reuses.
+    """
+
+    def __init__(self, store: JobStore, job: dict, log_handler: Callable[[str, dict], None] | None = None):
+        self._store = store
+        self._forward = log_handler
+        self.id, self.kind, self.corpus, self.params = job['id'], job['kind'], job['corpus'], job['params']
+        self.resumed = job['attempts'] > 1
+        self._lock = threading.Lock()
+        self._done, self._total, self._message = 0, job['total'], None
+        self._saved_at = self._checked_at = 0.0
+
+    def log_handler(self, method_type: str, value: dict):
+        if 'text' in value:
+            self._message = value['text']
+        self._forward and self._forward(method_type, value)
+
+    def set_total(self, total: int):
+        with self._lock:
+            self._total = total
+        self.save_progress(force=True)
+
+    def advance(self, items: int = 1):
+        with self._lock:
+            self._done += items
+        self.save_progress()
+
+    def save_progress(self, force: bool = False):
+        # Progress is written at most twice a second, jobs report it per page or chunk
+        if force or time.monotonic() - self._saved_at > 0.5:
+            self._saved_at = time.monotonic()
+            self._store.update_progress(self.id, self._done, self._total, self._message)
+
+    def check_cancelled(self):
+        if time.monotonic() - self._checked_at < 0.5:
+            return
+        self._checked_at = time.monotonic()
+        if self._store.is_cancel_requested(self.id):
+            raise JobCancelled(f'Job {self.id} was cancelled')
+
+    def checkpoint(self, key: str) -> str | None:
+        return self._store.get_checkpoint(self.corpus, self.kind, key)
+
+    def save_checkpoint(self, key: str, value: str):
+        self._store.put_checkpoint(self.corpus, self.kind, key, value)
+
+
+class JobRunner:
+    """
+    Runs the jobs of the JobStore in background threads. Every process polls the store; the process
+    that gets the lock of a job's corpus runs it. A job whose process died (status running, lock free)
+    is picked up again and resumes from its checkpoints. In gevent workers a job runs in an OS thread
+    of its own (see utils.start_thread), so it does not stall the chat sessions of the worker.
+    """
+
+    def __init__(self, store: JobStore, handlers: dict[str, Callable[[JobContext], None]],
+                 log_handler: Callable[[str, dict], None] | None = None):
+        self._store = store
+        self._handlers = handlers
+        self._log_handler = log_handler
+        self._poll_interval = float(os.getenv('JOB_POLL_INTERVAL', 2))
+        self._running = set()
+        self._wake = threading.Event()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    @property
+    def store(self) -> JobStore:
+        return self._store
+
+    def submit(self, kind: str, corpus: str, root: str, params: dict | None = None) -> tuple[dict, bool]:
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind {kind}, use one of {', '.join(self._handlers)}")
+        job, created = self._store.create(kind, corpus, root, params or {})
+        self._wake.set()
+        return job, created
+
+    def cancel(self, job_id: int) -> dict | None:
+        return self._store.request_cancel(job_id)
+
+    def _loop(self):
+        while True:
+            try:
+                self._schedule()
+            except sqlite3.Error:
+                # A busy database is retried with the next poll
+                pass
+            self._wake.wait(self._poll_interval)
+            self._wake.clear()
+
+    def _schedule(self):
+        for job in self._store.runnable():
+            if job['id'] in self._running:
+                continue
+            lock = try_lock_corpus(job['root'])
+            if lock is None:
+                continue
+            # Re-read under the lock, another process may have finished the job in the meantime
+            job = self._store.get(job['id'])
+            if job['status'] == 'running' and job['cancel_requested']:
+                self._finish(job, 'cancelled')
+            if job['status'] not in ACTIVE_STATES or not self._store.claim(job['id']):
+                lock.close()
+                continue
+            self._running.add(job['id'])
+            start_thread(self._run, self._store.get(job['id']), lock)
+
+    def _finish(self, job: dict, status: str, error: str | None = None):
+        self._store.finish(job['id'], status, error)
+        if status != 'failed':
+            # A failed job keeps its checkpoints, so retrying it skips the finished work
+            self._store.clear_checkpoints(job['corpus'], job['kind'])
+        job['status'] = status
+        text = f"Job {job['id']} ({job['kind']}) {status}" + (f': {error}' if error else '')
+        self._log_handler and self._log_handler('job', {'id': job['id'], 'status': status, 'text': text})
+
+    def _run(self, job: dict, lock):
+        context = JobContext(self._store, job, self._log_handler)
+        try:
+            self._log_handler and self._log_handler('job', {
+                'id': job['id'], 'status': 'running',
+                'text': f"Job {job['id']} ({job['kind']}) {'resumed' if context.resumed else 'started'}"})
+            self._handlers[job['kind']](context)
+            context.save_progress(force=True)
+            self._finish(job, 'done')
+        except JobCancelled:
+            context.save_progress(force=True)
+            self._finish(job, 'cancelled')
+        except Exception as e:
+            context.save_progress(force=True)
+            self._finish(job, 'failed', str(e) or repr(e))
+        finally:
+            self._running.discard(job['id'])
+            lock.close()
+
+
+_store = _store_pid = None
+_runner = _runner_pid = None
+_jobs_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    global _store, _store_pid
+    # SQLite connections must not cross a fork, so every process opens its own
+    if _store is None or _store_pid != os.getpid():
+        with _jobs_lock:
+            if _store is None or _store_pid != os.getpid():
+                path = os.getenv('JOB_DB_PATH', os.path.join(os.getcwd(), 'chat_bot_cache', 'jobs.sqlite'))
+                _store, _store_pid = JobStore(path), os.getpid()
+    return _store
+
+
+def get_job_runner(handlers: dict[str, Callable[[JobContext], None]],
+                   log_handler: Callable[[str, dict], None] | None = None) -> JobRunner:
+    """The job runner of this process; threads do not survive a fork, so every worker starts its own."""
+    global _runner, _runner_pid
+    if _runner is None or _runner_pid != os.getpid():
+        store = get_job_store()
+        with _jobs_lock:
+            if _runner is None or _runner_pid != os.getpid():
+                _runner, _runner_pid = JobRunner(store, handlers, log_handler), os.getpid()
+    return _runner
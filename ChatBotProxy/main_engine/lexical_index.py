@@ -0,0 +1,76 @@
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter
+
+LEXICAL_INDEX_FILE_NAME = 'bm25_index.json'
+
+
+def tokenize(text: str) -> list[str]:
+    # Keeps identifiers like sample_id or ElementType in one piece
+    return re.findall(r'\w+', text.lower())
+
+
+class BM25Index:
+    """
+    In-memory inverted index over the chunk texts, scored with Okapi BM25 and addressed by the same
+    chunk ids as the FAISS index. Finds exact terms (menu names, field names, element types) that
+    the embedding model does not capture.
+    """
+
+    def __init__(self, doc_terms: dict[int, dict[str, int]], k1: float = 1.5, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self._doc_terms = doc_terms
+        self._doc_lengths = {chunk_id: sum(terms.values()) for chunk_id, terms in doc_terms.items()}
+        self._avg_length = sum(self._doc_lengths.values()) / len(doc_terms) if doc_terms else 0.0
+        self._postings = {}
+        for chunk_id, terms in doc_terms.items():
+            for term, tf in terms.items():
+                self._postings.setdefault(term, []).append((chunk_id, tf))
+
+    @classmethod
+    def build(cls, ids, texts) -> 'BM25Index':
+        return cls({int(chunk_id): dict(Counter(tokenize(text))) for chunk_id, text in zip(ids, texts)})
+
+    @classmethod
+    def load(cls, root: str) -> 'BM25Index | None':
+        path = os.path.join(root, LEXICAL_INDEX_FILE_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            data = json.loads(f.read())
+        return cls({int(chunk_id): terms for chunk_id, terms in data['docs'].items()}, data['k1'], data['b'])
+
+    def save(self, root: str):
+        path = os.path.join(root, LEXICAL_INDEX_FILE_NAME)
+        with open(path + '.tmp', 'w+') as f:
+            f.write(json.dumps({'k1': self.k1, 'b': self.b, 'docs': self._doc_terms}))
+        os.replace(path + '.tmp', path)
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def search(self, query: str, top_k: int) -> list[tuple[int, float]]:
+        """Returns up to top_k (chunk id, score) pairs, best first. Chunks without a query term are left out."""
+        scores = {}
+        n = len(self._doc_terms)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[chunk_id] / self._avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(rankings: list[list[int]], top_k: int, k: int = 60) -> list[tuple[int, float]]:
+    """Merges ranked id lists: every list adds 1 / (k + rank) to the score of each of its ids."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (k + rank + 1)
+    return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def cache_key(model_name: str, template_version: str, prompt: str) -> str:
+    return hashlib.sha256(json.dumps([model_name, template_version, prompt]).encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    Persistent SQLite cache for LLM answers keyed by (model, prompt template version, prompt).
+
+    The cache is bounded by the total size of the stored answers; the least recently used entries
+    are evicted first.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS llm_cache ('
+                           'key TEXT PRIMARY KEY, answer TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)')
+        self._conn.commit()
+        self.hits = self.misses = 0
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute('SELECT answer FROM llm_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute('UPDATE llm_cache SET last_used = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, answer: str):
+        size = len(answer.encode('utf-8'))
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO llm_cache (key, answer, size, last_used) VALUES (?, ?, ?, ?)',
+                               (key, answer, size, time.time()))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache').fetchone()[0]
+        if total <= self._max_bytes:
+            return
+        freed = 0
+        for key, size in self._conn.execute('SELECT key, size FROM llm_cache ORDER BY last_used').fetchall():
+            if total - freed <= self._max_bytes:
+                break
+            self._conn.execute('DELETE FROM llm_cache WHERE key = ?', (key,))
+            freed += size
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache').fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': size}
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache | None:
+    global _llm_cache
+    if os.getenv('LLM_CACHE', 'true').lower() != 'true':
+        return None
+    if _llm_cache is None:
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                path = os.getenv('LLM_CACHE_PATH', os.path.join(os.getcwd(), 'chat_bot_cache', 'llm_cache.sqlite'))
+                _llm_cache = LLMCache(path, int(float(os.getenv('LLM_CACHE_MAX_MB', 512)) * 1024 * 1024))
+    return _llm_cache
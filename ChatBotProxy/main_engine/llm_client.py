@@ -0,0 +1,219 @@
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from typing import Iterator
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ChatBotProxy.main_engine.metrics import count_llm_request, observe_llm_stats, set_queue_depth
+
+DONE_STATS = ('total_duration', 'load_duration', 'prompt_eval_count', 'prompt_eval_duration', 'eval_count',
+              'eval_duration')
+
+
+class LLMClient:
+    """
+    Interface of the LLM backends. generate returns {'answer': str} or {'error': str}; stream yields
+    {'token': str, 'done': False} pieces and finally {'done': True, 'stats': dict} or
+    {'error': str, 'done': True}.
+    """
+
+    def generate(self, prompt: str, model_name: str) -> dict:
+        raise NotImplementedError
+
+    def stream(self, prompt: str, model_name: str) -> Iterator[dict]:
+        raise NotImplementedError
+
+
+class SampleClient(LLMClient):
+    """Answers every prompt with sample_answer.md, for testing without an LLM (ONLY_SAMPLE_ANSWER)."""
+
+    @staticmethod
+    def _sample_answer() -> str:
+        with open(os.path.join(os.path.dirname(__file__), 'sample_answer.md'), 'r') as f:
+            return f.read()
+
+    def generate(self, prompt: str, model_name: str) -> dict:
+        return {'answer': self._sample_answer()}
+
+    def stream(self, prompt: str, model_name: str) -> Iterator[dict]:
+        for token in re.findall(r'\S+\s*|\s+', self._sample_answer()):
+            yield {'token': token, 'done': False}
+        yield {'done': True, 'stats': {}}
+
+
+class OllamaBackend:
+    def __init__(self, url: str, max_concurrency: int):
+        self.url = url.rstrip('/')
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.in_flight = 0
+        self.failed_until = 0.0
+
+
+class RetryableError(Exception):
+    pass
+
+
+class OllamaClient(LLMClient):
+    """
+    Client for one or more ollama servers (OLLAMA_URLS).
+
+    All requests share one keep-alive session. Each server takes at most OLLAMA_MAX_CONCURRENCY
+    requests at once; a request goes to the server with the fewest requests in flight. Connection
+    errors, timeouts and 5xx answers are retried up to OLLAMA_RETRIES times with exponential backoff,
+    preferably on another server, and a failing server is skipped for OLLAMA_FAILURE_COOLDOWN seconds.
+    """
+
+    def __init__(self, urls: list[str] | None = None):
+        urls = urls or [url.strip() for url in os.getenv('OLLAMA_URLS', 'http://localhost:11434').split(',')
+                        if url.strip()]
+        max_concurrency = int(os.getenv('OLLAMA_MAX_CONCURRENCY', 4))
+        self._backends = [OllamaBackend(url, max_concurrency) for url in urls]
+        self._timeout = (float(os.getenv('OLLAMA_CONNECT_TIMEOUT', 5)), float(os.getenv('OLLAMA_READ_TIMEOUT', 300)))
+        self._retries = int(os.getenv('OLLAMA_RETRIES', 2))
+        self._backoff = float(os.getenv('OLLAMA_RETRY_BACKOFF', 0.5))
+        self._cooldown = float(os.getenv('OLLAMA_FAILURE_COOLDOWN', 10))
+        self._keep_alive = os.getenv('OLLAMA_KEEP_ALIVE') or None
+        self._options = {key: int(os.getenv(f'OLLAMA_{key.upper()}', 0)) for key in ('num_ctx', 'num_predict')}
+        self._options = {key: value for key, value in self._options.items() if value}
+        self._lock = threading.Lock()
+        self._round_robin = itertools.count()
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self._backends), pool_maxsize=max_concurrency)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def _payload(self, prompt: str, model_name: str, stream: bool) -> dict:
+        payload = {"prompt": prompt, "model": model_name, "stream": stream}
+        if self._keep_alive is not None:
+            payload['keep_alive'] = self._keep_alive
+        if self._options:
+            payload['options'] = self._options
+        return payload
+
+    def _pick(self, tried: set) -> OllamaBackend:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self._backends if b not in tried and b.failed_until <= now] \
+                         or [b for b in self._backends if b.failed_until <= now] or self._backends
+            offset = next(self._round_robin)
+            rotated = candidates[offset % len(candidates):] + candidates[:offset % len(candidates)]
+            backend = min(rotated, key=lambda b: b.in_flight)
+            backend.in_flight += 1
+            set_queue_depth(f'llm:{backend.url}', backend.in_flight)
+            return backend
+
+    def _release(self, backend: OllamaBackend, failed: bool = False):
+        with self._lock:
+            backend.in_flight -= 1
+            set_queue_depth(f'llm:{backend.url}', backend.in_flight)
+            count_llm_request(backend.url, 'failed' if failed else 'ok')
+            if failed:
+                backend.failed_until = time.monotonic() + self._cooldown
+
+    def _post(self, backend: OllamaBackend, payload: dict) -> requests.Response:
+        try:
+            response = self._session.post(f'{backend.url}/api/generate', json=payload, timeout=self._timeout,
+                                          stream=payload['stream'])
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise RetryableError(f'{backend.url}: {e}')
+        if response.status_code >= 500:
+            response.close()
+            raise RetryableError(f'{backend.url}: HTTP {response.status_code}')
+        return response
+
+    def _attempts(self) -> Iterator[int]:
+        for attempt in range(self._retries + 1):
+            if attempt:
+                time.sleep(self._backoff * 2 ** (attempt - 1))
+            yield attempt
+
+    def generate(self, prompt: str, model_name: str) -> dict:
+        payload, tried, error = self._payload(prompt, model_name, False), set(), None
+        for _ in self._attempts():
+            backend = self._pick(tried)
+            tried.add(backend)
+            failed = False
+            try:
+                with backend.slots:
+                    response = self._post(backend, payload)
+                    try:
+                        result = response.json()
+                    except ValueError as e:
+                        print("JSON parsing error:", e)
+                        print("Raw response content:", response.text)
+                        return {"error": "Invalid JSON response"}
+                    if 'error' in result:
+                        return {"error": result['error']}
+                    observe_llm_stats(result)
+                    return {"answer": result.get("response")}
+            except (RetryableError, requests.RequestException) as e:
+                failed, error = True, str(e)
+            finally:
+                self._release(backend, failed)
+        return {"error": f"LLM request failed: {error}"}
+
+    def stream(self, prompt: str, model_name: str) -> Iterator[dict]:
+        payload, tried, error = self._payload(prompt, model_name, True), set(), None
+        for _ in self._attempts():
+            backend = self._pick(tried)
+            tried.add(backend)
+            failed, started = False, False
+            try:
+                with backend.slots, self._post(backend, payload) as response:
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        try:
+                            chunk = json.loads(line)
+                        except ValueError as e:
+                            print("JSON parsing error:", e)
+                            print("Raw response content:", line)
+                            yield {"error": "Invalid JSON response", 'done': True}
+                            return
+                        if 'error' in chunk:
+                            yield {"error": chunk['error'], 'done': True}
+                            return
+                        if chunk.get('response'):
+                            started = True
+                            yield {'token': chunk['response'], 'done': False}
+                        if chunk.get('done'):
+                            observe_llm_stats(chunk)
+                            yield {'done': True, 'stats': {key: chunk.get(key) for key in DONE_STATS}}
+                            return
+                    raise RetryableError(f'{backend.url}: stream ended early')
+            except (RetryableError, requests.RequestException) as e:
+                failed, error = True, str(e)
+                if started:
+                    # Tokens already reached the client, a retry would repeat them
+                    yield {"error": f"LLM stream failed: {error}", 'done': True}
+                    return
+            finally:
+                self._release(backend, failed)
+        yield {"error": f"LLM request failed: {error}", 'done': True}
+
+
+LLM_BACKENDS = {'ollama': OllamaClient, 'sample': SampleClient}
+
+_client, _client_pid = None, None
+_client_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """The LLM client of this process, chosen by LLM_BACKEND (or 'sample' with ONLY_SAMPLE_ANSWER)."""
+    global _client, _client_pid
+    # Pooled connections must not be shared with forked (gunicorn) workers
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                name = os.getenv('LLM_BACKEND', 'ollama').lower()
+                if os.getenv('ONLY_SAMPLE_ANSWER', 'f').lower() == 'true':
+                    name = 'sample'
+                if name not in LLM_BACKENDS:
+                    raise ValueError(f"Unknown LLM backend {name}, use one of {', '.join(LLM_BACKENDS)}")
+                _client, _client_pid = LLM_BACKENDS[name](), os.getpid()
+    return _client
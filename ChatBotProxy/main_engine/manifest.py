@@ -0,0 +1,48 @@
+import hashlib
+import json
+import os
+
+MANIFEST_FILE_NAME = 'manifest.json'
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class Manifest:
+    """
+    Bookkeeping of an ingested docu root, kept in its manifest.json: for every page url its HTTP
+    validators, content hash and outgoing links, plus the chunks (FAISS id and raw text hash) it was
+    split into. The chunk texts themselves live in the SQLite backed chunk store (see chunk_store).
+    """
+
+    def __init__(self, root: str, pages: dict | None = None, next_id: int = 0):
+        self.root = root
+        self.pages = pages or {}
+        self.next_id = next_id
+
+    @classmethod
+    def load(cls, root: str) -> 'Manifest | None':
+        path = os.path.join(root, MANIFEST_FILE_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            data = json.loads(f.read())
+        return cls(root, data['pages'], data['next_id'])
+
+    def save(self):
+        path = os.path.join(self.root, MANIFEST_FILE_NAME)
+        with open(path + '.tmp', 'w+') as f:
+            f.write(json.dumps({'pages': self.pages, 'next_id': self.next_id}))
+        os.replace(path + '.tmp', path)
+
+    def allocate_id(self) -> int:
+        self.next_id += 1
+        return self.next_id - 1
+
+    def validators(self) -> dict[str, dict]:
+        return {url: {'etag': page.get('etag'), 'last_modified': page.get('last_modified'), 'links': page['links']}
+                for url, page in self.pages.items()}
+
+    def chunks(self) -> list[dict]:
+        return [chunk for page in self.pages.values() for chunk in page['chunks']]
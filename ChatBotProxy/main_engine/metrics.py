@@ -0,0 +1,146 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+# Seconds, from a FAISS search up to a long LLM generation
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+_metrics = None
+_metrics_available = True
+_metrics_lock = threading.Lock()
+# Set by setup_multiprocess_dir, the forked workers inherit it
+_multiprocess = False
+
+
+def metrics_enabled() -> bool:
+    return os.getenv('METRICS', 'true').lower() == 'true'
+
+
+def setup_multiprocess_dir():
+    """
+    Points prometheus_client at a fresh directory (METRICS_DIR) shared by all gunicorn workers, so
+    /metrics reports the sum over the workers. Must run in the master before any metric is created.
+    """
+    global _multiprocess
+    if not metrics_enabled():
+        return
+    path = os.getenv('METRICS_DIR') or os.path.join(os.getcwd(), 'chat_bot_cache', 'prometheus')
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = path
+    _multiprocess = True
+
+
+def mark_process_dead(pid: int):
+    """Gunicorn child_exit hook: drops the live gauges of a stopped worker."""
+    if metrics_enabled() and os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        try:
+            from prometheus_client import multiprocess
+        except ImportError:
+            return
+        multiprocess.mark_process_dead(pid)
+
+
+class _Metrics:
+    def __init__(self):
+        # Imported late: prometheus_client picks its multiprocess storage when it is imported. Processes
+        # other than the served workers (CLI, flask run) keep their metrics in memory.
+        if not _multiprocess:
+            os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+        from prometheus_client import Counter, Gauge, Histogram
+        self.stage_seconds = Histogram('chatbot_stage_seconds', 'Duration of request and ingestion stages', ['stage'],
+                                       buckets=LATENCY_BUCKETS)
+        self.cache_requests = Counter('chatbot_cache_requests', 'Cache lookups', ['cache', 'result'])
+        self.llm_tokens = Counter('chatbot_llm_tokens', 'Tokens processed by the LLM', ['kind'])
+        self.llm_tokens_per_second = Histogram('chatbot_llm_tokens_per_second',
+                                               'Generation speed of ollama (eval_count / eval_duration)',
+                                               buckets=TOKEN_RATE_BUCKETS)
+        self.llm_requests = Counter('chatbot_llm_requests', 'LLM requests', ['backend', 'result'])
+        self.queue_depth = Gauge('chatbot_queue_depth', 'Items waiting in a queue', ['queue'],
+                                 multiprocess_mode='livesum')
+
+
+def _get_metrics() -> _Metrics | None:
+    global _metrics, _metrics_available
+    if _metrics is None and _metrics_available and metrics_enabled():
+        with _metrics_lock:
+            if _metrics is None and _metrics_available:
+                try:
+                    _metrics = _Metrics()
+                except ImportError:
+                    # prometheus_client is optional (pip install chatbotproxy[metrics])
+                    _metrics_available = False
+                except Exception as e:
+                    _metrics_available = False
+                    logging.getLogger(__name__).warning(f'Metrics disabled, setup failed: {e!r}')
+    return _metrics
+
+
+def _record(record: Callable[[_Metrics], None]):
+    """Applies record to the metrics. A failing metric storage disables the metrics instead of failing the caller."""
+    global _metrics, _metrics_available
+    metrics = _get_metrics()
+    if metrics is None:
+        return
+    try:
+        record(metrics)
+    except Exception as e:
+        with _metrics_lock:
+            _metrics, _metrics_available = None, False
+        logging.getLogger(__name__).warning(f'Metrics disabled, recording failed: {e!r}')
+
+
+@contextmanager
+def span(stage: str, log_handler: Callable[[str, dict], None] | None = None):
+    """Times the enclosed block into the chatbot_stage_seconds histogram and reports it as 'timing' event."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        _record(lambda metrics: metrics.stage_seconds.labels(stage).observe(duration))
+        log_handler and log_handler('timing', {'stage': stage, 'seconds': duration,
+                                               'text': f'{stage} took {duration:.3f}s'})
+
+
+def count_cache(cache: str, hit: bool):
+    _record(lambda metrics: metrics.cache_requests.labels(cache, 'hit' if hit else 'miss').inc())
+
+
+def count_llm_request(backend: str, result: str):
+    _record(lambda metrics: metrics.llm_requests.labels(backend, result).inc())
+
+
+def observe_llm_stats(stats: dict):
+    """Records token counts and tokens/s from the final message of an ollama generation."""
+    _record(lambda metrics: _observe_llm_stats(metrics, stats))
+
+
+def _observe_llm_stats(metrics: _Metrics, stats: dict):
+    if stats.get('prompt_eval_count'):
+        metrics.llm_tokens.labels('prompt').inc(stats['prompt_eval_count'])
+    if stats.get('eval_count'):
+        metrics.llm_tokens.labels('eval').inc(stats['eval_count'])
+        if stats.get('eval_duration'):
+            metrics.llm_tokens_per_second.observe(stats['eval_count'] / (stats['eval_duration'] / 1e9))
+
+
+def set_queue_depth(queue: str, depth: int):
+    _record(lambda metrics: metrics.queue_depth.labels(queue).set(depth))
+
+
+def render_metrics() -> tuple[bytes, str] | None:
+    """The Prometheus exposition of all metrics (summed over the workers in multiprocess mode)."""
+    if _get_metrics() is None:
+        return None
+    from prometheus_client import CollectorRegistry, CONTENT_TYPE_LATEST, REGISTRY, generate_latest, multiprocess
+    registry = REGISTRY
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
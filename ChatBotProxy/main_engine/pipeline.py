@@ -0,0 +1,115 @@
+import queue
+import threading
+from typing import Callable, Iterable
+
+from ChatBotProxy.main_engine.metrics import set_queue_depth
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a Pipeline. func maps an input item to an iterable of output items and runs in
+    concurrency worker threads. flush, if given, is called once after the last input item and may
+    return remaining output items (e.g. a partially filled batch).
+    """
+
+    def __init__(self, name: str, func: Callable[[object], Iterable], concurrency: int = 1,
+                 flush: Callable[[], Iterable] | None = None):
+        self.name = name
+        self.func = func
+        self.concurrency = max(1, concurrency)
+        self.flush = flush
+
+
+class Pipeline:
+    """
+    Streams items through a chain of stages connected by bounded queues, so a slow stage applies
+    back pressure instead of buffering the whole corpus. The first exception raised by any stage
+    stops the pipeline and is re-raised by run.
+    """
+
+    def __init__(self, stages: list[Stage], queue_size: int = 32):
+        self._stages = stages
+        self._queue_size = queue_size
+        self._queues = []
+        self._error = None
+        self._stopped = threading.Event()
+
+    def queue_depths(self) -> dict[str, int]:
+        return {stage.name: q.qsize() for stage, q in zip(self._stages, self._queues)}
+
+    def _put(self, q: queue.Queue, item):
+        while not self._stopped.is_set():
+            try:
+                return q.put(item, timeout=0.1)
+            except queue.Full:
+                pass
+
+    def _get(self, q: queue.Queue):
+        while not self._stopped.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _fail(self, error: BaseException):
+        if self._error is None:
+            self._error = error
+        self._stopped.set()
+
+    def _run_stage(self, stage: Stage, in_queue: queue.Queue, out_queue: queue.Queue, end_markers: int,
+                   remaining: list[int], lock: threading.Lock):
+        try:
+            while (item := self._get(in_queue)) is not _DONE:
+                set_queue_depth(f'pipeline.{stage.name}', in_queue.qsize())
+                for result in stage.func(item) or []:
+                    self._put(out_queue, result)
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0 or self._stopped.is_set():
+                    return
+            # The last worker of a stage flushes it and passes one end marker on per worker of the next stage
+            for result in (stage.flush and stage.flush()) or []:
+                self._put(out_queue, result)
+            for _ in range(end_markers):
+                self._put(out_queue, _DONE)
+        except BaseException as e:
+            self._fail(e)
+
+    def run(self, items: Iterable) -> list:
+        self._queues = [queue.Queue(self._queue_size) for _ in self._stages]
+        out_queue = queue.Queue()
+        threads = []
+        for idx, stage in enumerate(self._stages):
+            if idx + 1 < len(self._stages):
+                next_queue, end_markers = self._queues[idx + 1], self._stages[idx + 1].concurrency
+            else:
+                next_queue, end_markers = out_queue, 1
+            remaining, lock = [stage.concurrency], threading.Lock()
+            for _ in range(stage.concurrency):
+                threads.append(threading.Thread(target=self._run_stage, daemon=True,
+                                                args=(stage, self._queues[idx], next_queue, end_markers, remaining,
+                                                      lock)))
+        for thread in threads:
+            thread.start()
+
+        try:
+            for item in items:
+                if self._stopped.is_set():
+                    break
+                self._put(self._queues[0], item)
+        except BaseException as e:
+            self._fail(e)
+        for _ in range(self._stages[0].concurrency):
+            self._put(self._queues[0], _DONE)
+
+        results = []
+        while (item := self._get(out_queue)) is not _DONE:
+            results.append(item)
+        for thread in threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+        return results
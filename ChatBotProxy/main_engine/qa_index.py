@@ -0,0 +1,93 @@
+import json
+import os
+import re
+
+import faiss
+import numpy as np
+
+QA_INDEX_FILE_NAME = 'qa_index.bin'
+QA_RECORDS_FILE_NAME = 'qa_pairs.json'
+
+# "1. **Question:** ...", "Q1: ...", "### Question 2 - ..."
+_QUESTION_RE = re.compile(r'^\s*(?:#+\s*)?(?:\*\*)?\s*(?:\d+[.)]\s*)?(?:\*\*)?\s*Q(?:uestion)?\s*\d*\s*[:.)-]\s*'
+                          r'(?P<text>.*)$', re.IGNORECASE)
+# "1. How do I ...?", "### 3. How do I ...?"
+_NUMBERED_QUESTION_RE = re.compile(r'^\s*(?:#+\s*)?(?:\*\*)?\s*\d+[.)]\s*(?P<text>.*\?)\s*(?:\*\*)?\s*$')
+# "**Answer:** ...", "A1: ...", "- A: ..."
+_ANSWER_RE = re.compile(r'^\s*(?:[-*]\s+)?(?:\*\*)?\s*A(?:nswer)?\s*\d*\s*[:.)-]\s*(?P<text>.*)$', re.IGNORECASE)
+
+
+def _clean(lines: list[str], separator: str = '\n') -> str:
+    return re.sub(r'\*\*|__', '', separator.join(line.strip() for line in lines)).strip()
+
+
+def parse_qa_pairs(text: str) -> list[tuple[str, str]]:
+    """Splits the LLM output of generate_questions into (question, answer) pairs."""
+    pairs = []
+    question = answer = None
+
+    def flush():
+        if question and answer and _clean(question) and _clean(answer):
+            pairs.append((_clean(question, ' '), _clean(answer)))
+
+    for line in text.splitlines():
+        if question is not None and answer is None and (match := _ANSWER_RE.match(line)):
+            answer = [match['text']]
+            continue
+        if match := _QUESTION_RE.match(line) or _NUMBERED_QUESTION_RE.match(line):
+            flush()
+            question, answer = [match['text']], None
+        elif answer is not None:
+            answer.append(line)
+        elif question is not None and line.strip():
+            # Answers without a label start on the line after the question mark
+            if _clean(question).endswith('?'):
+                answer = [line]
+            else:
+                question.append(line)
+    flush()
+    return pairs
+
+
+class QAIndex:
+    """
+    Cosine similarity index of the questions generated per chunk (see generate_questions). Every
+    record holds the question, its generated answer and the id of the chunk it was generated from.
+    """
+
+    def __init__(self, index, records: list[dict]):
+        self.index = index
+        self.records = records
+
+    @classmethod
+    def build(cls, records: list[dict], embeddings: np.ndarray) -> 'QAIndex':
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        faiss.normalize_L2(embeddings)
+        index = faiss.IndexFlatIP(embeddings.shape[1])
+        index.add(embeddings)
+        return cls(index, records)
+
+    @classmethod
+    def load(cls, root: str) -> 'QAIndex | None':
+        index_path, records_path = os.path.join(root, QA_INDEX_FILE_NAME), os.path.join(root, QA_RECORDS_FILE_NAME)
+        if not (os.path.exists(index_path) and os.path.exists(records_path)):
+            return None
+        with open(records_path, 'r') as f:
+            records = json.loads(f.read())
+        return cls(faiss.read_index(index_path), records)
+
+    def save(self, root: str):
+        index_path, records_path = os.path.join(root, QA_INDEX_FILE_NAME), os.path.join(root, QA_RECORDS_FILE_NAME)
+        faiss.write_index(self.index, index_path + '.tmp')
+        with open(records_path + '.tmp', 'w+') as f:
+            f.write(json.dumps(self.records))
+        os.replace(index_path + '.tmp', index_path)
+        os.replace(records_path + '.tmp', records_path)
+
+    def search(self, query_embeddings: np.ndarray, top_k: int) -> list[list[tuple[dict, float]]]:
+        """The top_k (record, cosine similarity) matches of every query, best first."""
+        query_embeddings = np.array(query_embeddings, dtype=np.float32)
+        faiss.normalize_L2(query_embeddings)
+        similarities, indices = self.index.search(query_embeddings, top_k)
+        return [[(self.records[idx], float(similarity)) for idx, similarity in zip(row_idx, row_sim) if idx >= 0]
+                for row_idx, row_sim in zip(indices, similarities)]
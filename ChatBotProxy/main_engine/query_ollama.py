@@ -1,35 +1,126 @@
-import faiss
-from ChatBotProxy.main_engine.utils import query_ollama as ql
 import os
 
-__all__ = ['query_ollama', 'build_question_prompt']
+from ChatBotProxy.main_engine.utils import query_ollama as ql, stream_ollama as sl
 
+__all__ = ['query_ollama', 'stream_ollama', 'build_question_prompt', 'prepare_answer', 'retrieval_mode',
+           'RETRIEVAL_MODES']
+
+from ChatBotProxy.main_engine.context_builder import assemble_context, get_token_counter
 from ChatBotProxy.main_engine.import_docu import ContextManager
+from ChatBotProxy.main_engine.lexical_index import reciprocal_rank_fusion
+from ChatBotProxy.main_engine.metrics import count_cache, span
+
+RETRIEVAL_MODES = ('vector', 'lexical', 'hybrid')
+
+
+def retrieval_mode(mode: str | None) -> str:
+    """The retrieval mode a request uses, RETRIEVAL_MODE unless it asks for one."""
+    mode = mode or os.getenv('RETRIEVAL_MODE', 'hybrid')
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode {mode}, use one of {', '.join(RETRIEVAL_MODES)}")
+    return mode
+
+
+def _vector_hits(query, top_k, corpus=None, embedding=None):
+    # Concurrent queries of this worker are embedded and searched together in micro-batches
+    distances, indices, qa_matches, snapshot = ContextManager(corpus).get_query_batcher().search(query, top_k,
+                                                                                                 embedding)
+    # Generated questions of chunks that an update removed since are skipped
+    qa_matches = [(record, similarity) for record, similarity in qa_matches if record['chunk_id'] in snapshot.texts]
+    # FAISS pads the result with -1 when the index holds fewer than top_k vectors
+    hits = [(int(idx), float(distance)) for idx, distance in zip(indices, distances) if idx >= 0]
+    return hits, qa_matches, snapshot
+
+
+def _stored(hits: list, snapshot) -> list:
+    # A worker that loads the chunk store while an update commits it can get ids the indexes still hold
+    return [(idx, score) for idx, score in hits if idx in snapshot.texts]
+
+
+def _search_hits(query, top_k, mode=None, corpus=None, embedding=None):
+    """
+    Returns the (chunk id, score) hits, best first, the (record, similarity) matches of the generated
+    questions and the snapshot they belong to. embedding is the query embedding if it is known already.
+    """
+    mode = retrieval_mode(mode)
+    if mode == 'lexical':
+        snapshot = ContextManager(corpus).get_retrieval_store().snapshot()
+        if snapshot.lexical is not None:
+            with span('retrieval.bm25_search'):
+                return _stored(snapshot.lexical.search(query, top_k), snapshot), [], snapshot
+    hits, qa_matches, snapshot = _vector_hits(query, top_k, corpus, embedding)
+    rankings = [[idx for idx, _ in hits]]
+    if qa_matches:
+        # The chunks the best matching generated questions were asked about
+        rankings.append(list(dict.fromkeys(record['chunk_id'] for record, _ in qa_matches)))
+    # Indexes written before the BM25 index existed only support vector search
+    if mode != 'vector' and snapshot.lexical is not None:
+        with span('retrieval.bm25_search'):
+            lexical_hits = snapshot.lexical.search(query, top_k)
+        rankings.append([idx for idx, _ in lexical_hits])
+    if len(rankings) > 1:
+        hits = reciprocal_rank_fusion(rankings, top_k, int(os.getenv('RRF_K', 60)))
+    return _stored(hits, snapshot), qa_matches, snapshot
 
-def search_index(query, index, model, doc_text_links: list[str], top_k=10):
-    """Search the FAISS index with a query and return top_k results."""
-    query_embedding = model.encode([query], convert_to_numpy=True)
-    distances, indices = index.search(query_embedding, top_k)
-    results = []
-    for i, idx in enumerate(indices[0]):
-        with open(doc_text_links[idx], 'r') as f:
-            results = [(f.read(), distances[0][i])]
-    return results
 
+def search_index(query, top_k=10, mode=None, corpus=None):
+    """Search the FAISS and/or BM25 index of a corpus with a query and return top_k results."""
+    hits, _, snapshot = _search_hits(query, top_k, mode, corpus)
+    return [(snapshot.texts[idx], score) for idx, score in hits]
 
-def build_question_prompt(question: str):
-    model = ContextManager().get_embedding_model()
-    # Save the index for later use
-    index = faiss.read_index(os.path.join(ContextManager().docu_root(), "faiss_index.bin"))
 
-    # Search FAISS index
-    results = search_index(question, index, model, ContextManager().get_document_links(), top_k=10)
+def _retrieve(question: str, mode: str | None, corpus: str | None, embedding=None):
+    # Search FAISS index, the index and chunk texts stay in memory (see RetrievalStore)
+    with span('retrieval.search'):
+        return _search_hits(question, int(os.getenv('CONTEXT_TOP_K', 10)), mode, corpus, embedding)
 
-    context = "\n".join([r[0] for r in results])
+
+def _generated_answer(qa_matches: list) -> dict | None:
+    if not qa_matches or qa_matches[0][1] < float(os.getenv('QA_ANSWER_THRESHOLD', 0.9)):
+        return None
+    record, similarity = qa_matches[0]
+    return {'answer': record['answer'], 'generated': {'question': record['question'], 'chunk_id': record['chunk_id'],
+                                                      'similarity': round(similarity, 4)}}
+
+
+def _question_prompt(question: str, hits: list, qa_matches: list, snapshot) -> str:
+    # A close generated question narrows the context down to the chunks it was generated from
+    close = [(record, similarity) for record, similarity in qa_matches
+             if similarity >= float(os.getenv('QA_CONTEXT_THRESHOLD', 0.8))]
+    chunk_ids = list(dict.fromkeys(record['chunk_id'] for record, _ in close)) or [idx for idx, _ in hits]
+    with span('retrieval.context'):
+        passages = assemble_context(chunk_ids, snapshot.texts, int(os.getenv('CONTEXT_TOKEN_BUDGET', 3000)),
+                                    get_token_counter())
+    passages += [f"Question: {record['question']}\nAnswer: {record['answer']}" for record, _ in close]
+
+    context = "\n\n".join(passages)
     # Command to send the POST request on the remote server
     prompt = f"Based on the following context, answer the question about Chemotion:\n\nContext: {context}\n\nQuestion: {question}"
     return prompt
 
 
+def build_question_prompt(question: str, mode: str | None = None, corpus: str | None = None):
+    return _question_prompt(question, *_retrieve(question, mode, corpus))
+
+
+def prepare_answer(question: str, mode: str | None = None, corpus: str | None = None,
+                   embedding=None) -> tuple[dict | None, str | None]:
+    """
+    Returns (generated answer, None) if the question matches one of the questions generated for the
+    chunks by at least QA_ANSWER_THRESHOLD cosine similarity, otherwise (None, prompt for the LLM).
+    embedding is the question embedding if the answer cache computed it already.
+    """
+    hits, qa_matches, snapshot = _retrieve(question, mode, corpus, embedding)
+    generated = _generated_answer(qa_matches)
+    count_cache('generated_answer', generated is not None)
+    if generated is not None:
+        return generated, None
+    return None, _question_prompt(question, hits, qa_matches, snapshot)
+
+
 def query_ollama(prompt: str, model_name: str):
     return ql(prompt, model_name)
+
+
+def stream_ollama(prompt: str, model_name: str):
+    return sl(prompt, model_name)
@@ -0,0 +1,124 @@
+import os
+import shutil
+import threading
+import time
+
+import faiss
+
+from ChatBotProxy.main_engine.chunk_store import ChunkReader, has_chunk_store, migrate_legacy_layout
+from ChatBotProxy.main_engine.index_factory import IndexParams
+from ChatBotProxy.main_engine.lexical_index import BM25Index
+from ChatBotProxy.main_engine.metrics import span
+from ChatBotProxy.main_engine.qa_index import QAIndex
+
+INDEX_FILE_NAME = 'faiss_index.bin'
+GENERATION_FILE_NAME = 'index_generation'
+
+
+def read_generation(root: str) -> int | None:
+    try:
+        with open(os.path.join(root, GENERATION_FILE_NAME), 'r') as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def bump_generation(root: str) -> int:
+    """Mark the files in root as a new, complete index generation."""
+    generation = (read_generation(root) or 0) + 1
+    tmp_path = os.path.join(root, GENERATION_FILE_NAME + '.tmp')
+    with open(tmp_path, 'w+') as f:
+        f.write(str(generation))
+    os.replace(tmp_path, os.path.join(root, GENERATION_FILE_NAME))
+    return generation
+
+
+def stage_root(root: str) -> str:
+    """
+    A fresh directory next to root to build a full rebuild of it in. It continues the generation count
+    of root, so workers still serving the old files see the swapped in build as a new generation.
+    """
+    staging = root + '.staging'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    generation = read_generation(root)
+    if generation is not None:
+        with open(os.path.join(staging, GENERATION_FILE_NAME), 'w+') as f:
+            f.write(str(generation))
+    return staging
+
+
+def swap_root(staging: str, root: str):
+    """Replaces root by the complete build in staging (see stage_root)."""
+    old = root + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    # Between the renames root has no generation file, so running workers keep their snapshot.
+    # Workers that map files of the old root keep them alive until they swap.
+    if os.path.isdir(root):
+        os.rename(root, old)
+    os.rename(staging, root)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+class RetrievalSnapshot:
+    def __init__(self, generation: int, index, texts: ChunkReader, params: IndexParams, lexical: BM25Index | None = None,
+                 qa: QAIndex | None = None):
+        self.generation = generation
+        self.index = index
+        self.texts = texts
+        self.params = params
+        self.lexical = lexical
+        self.qa = qa
+
+    def search(self, query_embeddings, top_k: int):
+        return self.index.search(self.params.prepare(query_embeddings), top_k)
+
+
+class RetrievalStore:
+    """
+    Keeps the FAISS index of a docu root in memory, next to a memory mapped view of its chunk store.
+
+    The store is reloaded as a whole when the generation file in the docu root changes, so
+    requests always search one consistent snapshot.
+    """
+
+    def __init__(self, root: str):
+        self._root = root
+        self._use_mmap = os.getenv('FAISS_MMAP', 'f').lower() == 'true'
+        self._check_interval = float(os.getenv('INDEX_RELOAD_INTERVAL', 1.0))
+        self._snapshot = None
+        self._last_check = 0.0
+        self._load_lock = threading.Lock()
+
+    def _load(self, generation: int) -> RetrievalSnapshot:
+        io_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if self._use_mmap else 0
+        index = faiss.read_index(os.path.join(self._root, INDEX_FILE_NAME), io_flags)
+        params = IndexParams.load(self._root)
+        params.apply(index)
+        if not has_chunk_store(self._root):
+            migrate_legacy_layout(self._root)
+        return RetrievalSnapshot(generation, index, ChunkReader(self._root), params, BM25Index.load(self._root),
+                                 QAIndex.load(self._root))
+
+    def _is_stale(self, generation: int | None) -> bool:
+        if self._snapshot is None:
+            return True
+        # A missing generation file means a rebuild is in progress, keep serving the old snapshot.
+        return generation is not None and generation != self._snapshot.generation
+
+    def snapshot(self) -> RetrievalSnapshot:
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._last_check < self._check_interval:
+            return self._snapshot
+        self._last_check = now
+        generation = read_generation(self._root)
+        if self._is_stale(generation):
+            with self._load_lock:
+                generation = read_generation(self._root)
+                if self._is_stale(generation):
+                    with span('index.load'):
+                        self._snapshot = self._load(generation or 0)
+        return self._snapshot
+
+    def is_loaded(self) -> bool:
+        return self._snapshot is not None
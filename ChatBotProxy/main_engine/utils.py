@@ -1,20 +1,87 @@
 import os
+import threading
+from typing import Iterator
 
-import requests
+from ChatBotProxy.main_engine.llm_cache import get_llm_cache, cache_key
+from ChatBotProxy.main_engine.llm_client import get_llm_client, SampleClient
+from ChatBotProxy.main_engine.metrics import count_cache
 
 
-def query_ollama(prompt: str, model_name: str, stream: bool = False) -> dict[str:str]:
-    if os.getenv('ONLY_SAMPLE_ANSWER', 'f') .lower() == 'true':
-        with open(os.path.join(os.path.dirname(__file__), 'sample_answer.md'), 'r') as f:
-            return {'answer': f.read()}
+def server_mode() -> str:
+    return os.getenv('SERVER_MODE', 'sync').lower()
 
-    response = requests.post(
-        "http://localhost:11434/api/generate",
-        json= {"prompt": prompt, "model": model_name, "stream": stream}
-    )
+
+def run_blocking(func, *args, **kwargs):
+    """
+    Runs CPU bound work such as embedding or FAISS searches. Under gevent workers it is moved to the
+    hub's thread pool so it does not stall the other greenlets of the worker.
+    """
+    if server_mode() == 'gevent':
+        from gevent import monkey, get_hub
+        if monkey.is_module_patched('threading'):
+            return get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
+
+
+def start_thread(func, *args):
+    """
+    Runs long, partly CPU bound work such as a background job in a daemon thread. Under gevent workers
+    it gets a real OS thread, a greenlet would stall all other greenlets of the worker until it is done.
+    """
+    if server_mode() == 'gevent':
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            monkey.get_original('_thread', 'start_new_thread')(func, args)
+            return
+    threading.Thread(target=func, args=args, daemon=True).start()
+
+
+def limit_torch_threads(threads: int):
+    """Caps the intra-op threads of torch, so the workers of one host do not oversubscribe its cores."""
     try:
-        return {"answer": response.json().get("response")}
-    except ValueError as e:
-        print("JSON parsing error:", e)
-        print("Raw response content:", response.text)
-        return {"error": "Invalid JSON response"}
\ No newline at end of file
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(max(1, threads))
+
+
+def query_ollama(prompt: str, model_name: str, stream: bool = False, template_version: str | None = None) -> dict[str:str]:
+    """
+    Sends the prompt to the LLM backend (see llm_client). Answers to prompts with a template_version
+    are cached on disk, so reruns with the same model, prompt template and input text skip the LLM call.
+    """
+    llm_client = get_llm_client()
+    if isinstance(llm_client, SampleClient):
+        # Sample answers must not end up in the cache of the real model
+        return llm_client.generate(prompt, model_name)
+
+    llm_cache = get_llm_cache() if template_version is not None else None
+    if llm_cache is not None:
+        key = cache_key(model_name, template_version, prompt)
+        answer = llm_cache.get(key)
+        count_cache('llm', answer is not None)
+        if answer is not None:
+            return {'answer': answer}
+        result = query_ollama(prompt, model_name, stream)
+        if result.get('answer') is not None:
+            llm_cache.put(key, result['answer'])
+        return result
+
+    if stream:
+        answer = []
+        for chunk in stream_ollama(prompt, model_name):
+            if 'error' in chunk:
+                return chunk
+            answer.append(chunk.get('token', ''))
+        return {"answer": ''.join(answer)}
+
+    return llm_client.generate(prompt, model_name)
+
+
+def stream_ollama(prompt: str, model_name: str) -> Iterator[dict]:
+    """
+    Streams the answer of the LLM backend. Yields {'token': str, 'done': False} for every generated
+    piece of text and finally {'done': True, 'stats': dict} with the timings and token counts of
+    ollama's last message.
+    """
+    return get_llm_client().stream(prompt, model_name)
@@ -1,7 +1,12 @@
+import gc
 import os
+import sys
 from dotenv import load_dotenv, find_dotenv
 from gunicorn.app.base import BaseApplication
-from ChatBotProxy.app import app  # Import your Flask app
+from ChatBotProxy.app import app, job_runner  # Import your Flask app
+from ChatBotProxy.main_engine.import_docu import ContextManager, corpus_names
+from ChatBotProxy.main_engine.metrics import mark_process_dead, setup_multiprocess_dir
+from ChatBotProxy.main_engine.utils import limit_torch_threads
 
 class GunicornApp(BaseApplication):
     def __init__(self, application, options=None):
@@ -18,11 +23,73 @@ class GunicornApp(BaseApplication):
         return self.application
 
 
+def _torch_threads(workers: int) -> int:
+    return int(os.getenv('TORCH_THREADS', 0)) or max(1, (os.cpu_count() or 1) // workers)
+
+
+def warm_up_corpora() -> bool:
+    """Warms up the corpora that fit into CORPUS_MAX_LOADED, default corpus first. Returns whether an index was found."""
+    names = corpus_names()[:max(1, int(os.getenv('CORPUS_MAX_LOADED', 4)))]
+    return any([ContextManager(name).warm_up() for name in names])
+
+
+def preload(workers: int):
+    """
+    Loads the embedding model, the FAISS index and the chunk store in the master. The forked workers
+    share these pages copy-on-write instead of each loading a private copy on its first request.
+    """
+    limit_torch_threads(_torch_threads(workers))
+    # The tokenizers thread pool does not survive the fork
+    os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+    if not warm_up_corpora():
+        app.logger.warning('No index found, workers load it with the first request after an update')
+    # Keeps the garbage collector of the workers from touching (and thereby copying) the preloaded objects
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    limit_torch_threads(_torch_threads(server.cfg.workers))
+
+
+def post_worker_init(worker):
+    # Without preload every worker warms up on its own, before it accepts requests
+    if not worker.cfg.preload_app:
+        warm_up_corpora()
+    # Picks up queued jobs and resumes the ones of a worker that died
+    job_runner()
+
+
+def _exec_gevent_patched():
+    """
+    gevent has to patch the standard library before ssl, threading and requests are imported, which
+    already happened in this process. Restarts the server in a fresh interpreter that patches first.
+    """
+    os.execv(sys.executable, [sys.executable, '-c', 'from gevent import monkey; monkey.patch_all(); '
+                                                    'from ChatBotProxy.run_gunicorn import run; run()'])
+
+
 def run():
     options = {
         "bind": f"{os.getenv('HOST', '127.0.0.1')}:{os.getenv('PORT', '8000')}",
         "workers": int(os.getenv("WORKERS", 4)),
+        # SERVER_MODE=gevent serves every worker with an event loop, so slow LLM calls do not pin workers
+        "worker_class": 'gevent' if os.getenv('SERVER_MODE', 'sync').lower() == 'gevent' else 'sync',
+        "worker_connections": int(os.getenv('WORKER_CONNECTIONS', 1000)),
+        "preload_app": os.getenv('PRELOAD', 'true').lower() == 'true',
+        "post_fork": post_fork,
+        "post_worker_init": post_worker_init,
+        "child_exit": lambda server, worker: mark_process_dead(worker.pid),
     }
+    if options["worker_class"] == 'gevent':
+        from gevent import monkey
+        if not monkey.is_module_patched('socket'):
+            _exec_gevent_patched()
+    if options["workers"] > 1 and not os.getenv('SOCKETIO_MESSAGE_QUEUE'):
+        app.logger.warning('SOCKETIO_MESSAGE_QUEUE is not set, progress events only reach clients of the same worker')
+    # Every worker writes its metrics to a shared directory, /metrics sums them up
+    setup_multiprocess_dir()
+    if options["preload_app"]:
+        preload(options["workers"])
     GunicornApp(app, options).run()
 
 
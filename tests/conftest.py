@@ -0,0 +1,23 @@
+import pytest
+
+from ChatBotProxy.main_engine.fake_ollama import FakeOllamaServer
+
+
+@pytest.fixture(autouse=True)
+def no_metrics(monkeypatch):
+    # Keeps the tests independent of prometheus_client and of each other
+    monkeypatch.setenv('METRICS', 'false')
+
+
+@pytest.fixture
+def fake_ollama():
+    """Starts FakeOllamaServers with the given arguments and stops them after the test."""
+    servers = []
+
+    def start(**kwargs) -> FakeOllamaServer:
+        servers.append(FakeOllamaServer(**kwargs).start())
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.stop()
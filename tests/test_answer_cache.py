@@ -0,0 +1,50 @@
+import numpy as np
+
+from ChatBotProxy.main_engine.answer_cache import SemanticAnswerCache
+
+
+def _embedding(*values) -> np.ndarray:
+    return np.array(values, dtype=np.float32)
+
+
+def test_similar_question_gets_the_cached_answer():
+    cache = SemanticAnswerCache(lambda: 1)
+    cache.put(_embedding(1, 0, 0), 'How do I log in?', {'answer': 'With your account.'})
+    assert cache.get(_embedding(0.99, 0.01, 0)) == {'answer': 'With your account.'}
+    assert cache.get(_embedding(0, 1, 0)) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_answers_are_kept_apart_by_partition():
+    cache = SemanticAnswerCache(lambda: 1)
+    cache.put(_embedding(1, 0, 0), 'How do I log in?', {'answer': 'hybrid answer'}, 'hybrid')
+    assert cache.get(_embedding(1, 0, 0), 'lexical') is None
+    cache.put(_embedding(1, 0, 0), 'How do I log in?', {'answer': 'lexical answer'}, 'lexical')
+    assert cache.get(_embedding(1, 0, 0), 'hybrid') == {'answer': 'hybrid answer'}
+    assert cache.get(_embedding(1, 0, 0), 'lexical') == {'answer': 'lexical answer'}
+
+
+def test_least_recently_used_entry_is_evicted(monkeypatch):
+    monkeypatch.setenv('ANSWER_CACHE_MAX_ENTRIES', '2')
+    cache = SemanticAnswerCache(lambda: 1)
+    cache.put(_embedding(1, 0, 0), 'first', {'answer': '1'}, 'hybrid')
+    cache.put(_embedding(0, 1, 0), 'second', {'answer': '2'}, 'vector')
+    assert cache.get(_embedding(1, 0, 0), 'hybrid') == {'answer': '1'}
+    cache.put(_embedding(0, 0, 1), 'third', {'answer': '3'}, 'hybrid')
+    assert cache.get(_embedding(0, 1, 0), 'vector') is None
+    assert cache.get(_embedding(1, 0, 0), 'hybrid') == {'answer': '1'}
+    assert cache.get(_embedding(0, 0, 1), 'hybrid') == {'answer': '3'}
+
+
+def test_new_generation_clears_the_cache():
+    generation = [1]
+    cache = SemanticAnswerCache(lambda: generation[0])
+    cache.put(_embedding(1, 0, 0), 'How do I log in?', {'answer': 'With your account.'})
+    generation[0] = 2
+    assert cache.get(_embedding(1, 0, 0)) is None
+
+
+def test_errors_are_not_cached():
+    cache = SemanticAnswerCache(lambda: 1)
+    cache.put(_embedding(1, 0, 0), 'How do I log in?', {'error': 'LLM request failed'})
+    assert cache.get(_embedding(1, 0, 0)) is None
@@ -0,0 +1,158 @@
+import json
+import os
+
+from ChatBotProxy.main_engine.chunk_store import ChunkReader, ChunkWriter, compact, has_chunk_store, \
+    migrate_legacy_layout
+
+
+def _data_files(root) -> list[str]:
+    return sorted(name for name in os.listdir(root) if name.endswith('.dat'))
+
+
+def test_write_and_read(tmp_path):
+    writer = ChunkWriter(str(tmp_path))
+    writer.add(7, 'second chunk', 'https://docs/a', 'Intro', 1, (10, 20))
+    writer.add(3, 'first chunk with ümlauts', 'https://docs/a', 'Intro', 0, (0, 12))
+    writer.add(5, 'other page', 'https://docs/b')
+    writer.commit()
+
+    reader = ChunkReader(str(tmp_path))
+    assert len(reader) == 3 and 3 in reader and 4 not in reader
+    assert reader.ids() == [3, 7, 5]
+    assert reader[3] == 'first chunk with ümlauts'
+    assert reader.meta(7) == {'id': 7, 'url': 'https://docs/a', 'header': 'Intro', 'seq': 1, 'span': (10, 20)}
+    assert reader.meta(5)['span'] is None
+    assert reader.fragmentation() == 0.0
+
+
+def test_append_move_and_remove(tmp_path):
+    writer = ChunkWriter(str(tmp_path))
+    writer.add(0, 'kept', 'https://docs/a', None, 0, (0, 4))
+    writer.add(1, 'removed', 'https://docs/a', None, 1, (4, 11))
+    writer.commit()
+
+    writer = ChunkWriter(str(tmp_path))
+    writer.remove([1])
+    writer.move(0, 1, (3, 7))
+    writer.add(2, 'new', 'https://docs/a', None, 0, (0, 3))
+    writer.commit()
+
+    reader = ChunkReader(str(tmp_path))
+    assert reader.ids() == [2, 0]
+    assert reader[2] == 'new' and reader.meta(0)['span'] == (3, 7)
+    assert reader.fragmentation() == len('removed') / len('keptremovednew')
+    assert len(_data_files(tmp_path)) == 1
+
+
+def test_rebuild_replaces_the_data_file(tmp_path):
+    writer = ChunkWriter(str(tmp_path))
+    writer.add(0, 'old')
+    writer.commit()
+    old_files = _data_files(tmp_path)
+
+    writer = ChunkWriter(str(tmp_path), rebuild=True)
+    writer.add(0, 'new')
+    # Readers keep seeing the old store until the commit
+    assert ChunkReader(str(tmp_path))[0] == 'old'
+    writer.commit()
+
+    assert ChunkReader(str(tmp_path))[0] == 'new'
+    assert len(_data_files(tmp_path)) == 1 and _data_files(tmp_path) != old_files
+
+
+def test_abort_keeps_the_old_store(tmp_path):
+    writer = ChunkWriter(str(tmp_path))
+    writer.add(0, 'old')
+    writer.commit()
+    old_files = _data_files(tmp_path)
+
+    writer = ChunkWriter(str(tmp_path), rebuild=True)
+    writer.add(0, 'new')
+    writer.abort()
+    writer = ChunkWriter(str(tmp_path))
+    writer.add(1, 'not committed')
+    writer.abort()
+
+    reader = ChunkReader(str(tmp_path))
+    assert reader.ids() == [0] and reader[0] == 'old'
+    assert _data_files(tmp_path) == old_files
+
+
+def test_compact(tmp_path):
+    writer = ChunkWriter(str(tmp_path))
+    for chunk_id in range(10):
+        writer.add(chunk_id, f'chunk {chunk_id}', 'https://docs/a', f'Header {chunk_id}', chunk_id,
+                   (chunk_id * 10, chunk_id * 10 + 7))
+    writer.commit()
+    writer = ChunkWriter(str(tmp_path))
+    writer.remove(list(range(0, 10, 2)))
+    writer.commit()
+    before = ChunkReader(str(tmp_path))
+    assert before.fragmentation() > 0.4
+
+    compact(str(tmp_path))
+
+    reader = ChunkReader(str(tmp_path))
+    assert reader.fragmentation() == 0.0
+    assert reader.ids() == [1, 3, 5, 7, 9]
+    assert [reader[i] for i in reader.ids()] == [before[i] for i in before.ids()]
+    assert [reader.meta(i) for i in reader.ids()] == [before.meta(i) for i in before.ids()]
+    assert len(_data_files(tmp_path)) == 1
+
+
+def _write_legacy_layout(root, texts: list[str], ids: list[int], manifest: dict | None = None):
+    # index.json of the legacy layout holds the absolute paths of another working directory
+    links = []
+    for idx, text in enumerate(texts):
+        with open(os.path.join(root, f'chunk_{idx}.txt'), 'w') as f:
+            f.write(text)
+        links.append(f'/somewhere/else/chat_bot_cache/docu/chunk_{idx}.txt')
+    with open(os.path.join(root, 'index.json'), 'w') as f:
+        f.write(json.dumps({'links': links, 'ids': ids}))
+    if manifest is not None:
+        with open(os.path.join(root, 'manifest.json'), 'w') as f:
+            f.write(json.dumps(manifest))
+
+
+def test_migrate_legacy_layout(tmp_path):
+    root = str(tmp_path)
+    _write_legacy_layout(root, ['a0', 'a1', 'b0'], [4, 5, 9], {'pages': {
+        'https://docs/a': {'chunks': [{'id': 4}, {'id': 5}]},
+        'https://docs/b': {'chunks': [{'id': 9}]},
+    }})
+
+    migrate_legacy_layout(root)
+
+    assert has_chunk_store(root)
+    reader = ChunkReader(root)
+    assert reader.ids() == [4, 5, 9]
+    assert [reader[i] for i in reader.ids()] == ['a0', 'a1', 'b0']
+    assert reader.meta(5) == {'id': 5, 'url': 'https://docs/a', 'header': None, 'seq': 1, 'span': None}
+    assert reader.meta(9)['url'] == 'https://docs/b'
+    assert not os.path.exists(os.path.join(root, 'index.json'))
+    assert not [name for name in os.listdir(root) if name.endswith('.txt')]
+
+
+def test_migrate_legacy_layout_without_manifest(tmp_path):
+    root = str(tmp_path)
+    _write_legacy_layout(root, ['first', 'second'], [0, 1])
+
+    migrate_legacy_layout(root)
+    # A second call, e.g. from another worker, finds the chunk store and does nothing
+    migrate_legacy_layout(root)
+
+    reader = ChunkReader(root)
+    assert [reader[i] for i in reader.ids()] == ['first', 'second']
+    assert [reader.meta(i)['seq'] for i in reader.ids()] == [0, 1]
+    assert reader.meta(0)['url'] is None
+
+
+def test_migrate_without_legacy_layout(tmp_path):
+    migrate_legacy_layout(str(tmp_path))
+    assert not has_chunk_store(str(tmp_path))
+
+
+def test_migrate_without_docu_root(tmp_path):
+    root = str(tmp_path / 'docu')
+    migrate_legacy_layout(root)
+    assert not os.path.exists(root)
@@ -0,0 +1,70 @@
+import pytest
+
+from ChatBotProxy.main_engine.chunk_store import ChunkReader, ChunkWriter
+from ChatBotProxy.main_engine.context_builder import assemble_context
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+SHARED = 'the text both chunks share at their border'
+
+
+@pytest.fixture
+def chunks(tmp_path):
+    writer = ChunkWriter(str(tmp_path))
+    # Page a: three consecutive chunks, the first two overlap by SHARED
+    writer.add(0, f'Installation needs docker. {SHARED}', 'https://docs/a', 'Install', 0, (0, 70))
+    writer.add(1, f'{SHARED} and then you start the server.', 'https://docs/a', 'Install', 1, (27, 110))
+    writer.add(2, 'Configure the mail server in the env file.', 'https://docs/a', 'Install', 2, (110, 150))
+    # Page a: rewritten by the LLM, its raw text lies within the one of chunk 0
+    writer.add(3, 'Docker is required.', 'https://docs/a', 'Install', 3, (0, 26))
+    # Page b: its text repeats within chunk 4
+    writer.add(4, 'Samples live in collections. Collections can be shared.', 'https://docs/b', 'Samples', 0, (0, 55))
+    writer.add(5, 'Collections can be shared.', 'https://docs/b', 'Samples', 1, (60, 86))
+    # Page c: no raw span recorded
+    writer.add(6, 'Reactions link samples.', 'https://docs/c', None, 0)
+    writer.commit()
+    return ChunkReader(str(tmp_path))
+
+
+def test_consecutive_chunks_are_merged(chunks):
+    assert assemble_context([1, 0], chunks, 100, count_words) == [
+        f'Installation needs docker. {SHARED} and then you start the server.']
+
+
+def test_chunks_without_overlap_are_joined(chunks):
+    assert assemble_context([2, 1], chunks, 100, count_words) == [
+        f'{SHARED} and then you start the server.\nConfigure the mail server in the env file.']
+
+
+def test_passages_follow_their_best_hit(chunks):
+    assert assemble_context([6, 4, 2], chunks, 100, count_words) == [
+        'Reactions link samples.',
+        'Samples live in collections. Collections can be shared.',
+        'Configure the mail server in the env file.',
+    ]
+
+
+def test_contained_spans_are_dropped(chunks):
+    assert assemble_context([0, 3], chunks, 100, count_words) == [f'Installation needs docker. {SHARED}']
+    # Only a better hit covers a chunk
+    assert assemble_context([3, 0], chunks, 100, count_words) == [
+        'Docker is required.', f'Installation needs docker. {SHARED}']
+
+
+def test_repeated_text_is_dropped(chunks):
+    assert assemble_context([4, 5], chunks, 100, count_words) == [
+        'Samples live in collections. Collections can be shared.']
+
+
+def test_token_budget(chunks):
+    # Chunk 4 does not fit any more, the smaller chunk 6 still does
+    assert assemble_context([2, 4, 6], chunks, 13, count_words) == [
+        'Configure the mail server in the env file.', 'Reactions link samples.']
+
+
+def test_oversized_first_chunk_is_cut(chunks):
+    context = assemble_context([2, 6], chunks, 4, count_words)
+    assert context == ['Configure the mail server in the env file.'[:42 * 4 // 8]]
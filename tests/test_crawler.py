@@ -0,0 +1,90 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from ChatBotProxy.main_engine.crawler import DocusaurusCrawler
+
+INDEX = '<a href="/docs/a">A</a> <a href="/docs/b">B</a>'
+
+
+@pytest.fixture
+def site():
+    """A docs site of /docs/ linking /docs/a and /docs/b; status and delay of /docs/b can be changed."""
+    state = {'status': 200, 'delay': 0.0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, delay = (state['status'], state['delay']) if self.path == '/docs/b' else (200, 0.0)
+            time.sleep(delay)
+            body = (INDEX if self.path == '/docs/' else f'<p>{self.path}</p>').encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+
+        def handle_error(self, request, client_address):
+            # The crawler hung up on a delayed page
+            pass
+
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state['url'] = f'http://127.0.0.1:{server.server_address[1]}'
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def _crawler(site, monkeypatch) -> DocusaurusCrawler:
+    monkeypatch.setenv('CRAWL_READ_TIMEOUT', '0.5')
+    return DocusaurusCrawler(site['url'], '/docs/', rate=0)
+
+
+def _known(crawler: DocusaurusCrawler) -> dict:
+    return {url: {'etag': None, 'last_modified': None, 'links': page.links} for url, page in crawler.crawl().items()}
+
+
+def test_crawl(site, monkeypatch):
+    pages = _crawler(site, monkeypatch).crawl()
+    assert list(pages) == ['/docs/', '/docs/a', '/docs/b']
+    assert pages['/docs/'].links == ['/docs/a', '/docs/b']
+    assert pages['/docs/b'].html == '<p>/docs/b</p>'
+
+
+@pytest.mark.parametrize('status', [500, 503, 429])
+def test_known_page_keeps_its_copy_on_transient_errors(site, monkeypatch, status):
+    crawler = _crawler(site, monkeypatch)
+    known = _known(crawler)
+    site['status'] = status
+    pages = crawler.crawl(known)
+    assert '/docs/b' in pages and pages['/docs/b'].not_modified
+
+
+@pytest.mark.parametrize('status', [404, 410])
+def test_known_page_removed_upstream_is_dropped(site, monkeypatch, status):
+    crawler = _crawler(site, monkeypatch)
+    known = _known(crawler)
+    site['status'] = status
+    assert list(crawler.crawl(known)) == ['/docs/', '/docs/a']
+
+
+def test_new_page_with_error_status_is_skipped(site, monkeypatch):
+    site['status'] = 503
+    assert list(_crawler(site, monkeypatch).crawl()) == ['/docs/', '/docs/a']
+
+
+def test_timeouts(site, monkeypatch):
+    crawler = _crawler(site, monkeypatch)
+    known = _known(crawler)
+    site['delay'] = 2
+    assert crawler.crawl(known)['/docs/b'].not_modified
+    with pytest.raises(requests.Timeout):
+        crawler.crawl()
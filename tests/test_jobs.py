@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+
+import pytest
+
+from ChatBotProxy.main_engine.jobs import JobRunner, JobStore, try_lock_corpus
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setenv('JOB_POLL_INTERVAL', '0.05')
+    return JobStore(str(tmp_path / 'jobs.sqlite'))
+
+
+def _wait_for(store: JobStore, job_id: int, statuses: tuple, timeout: float = 10) -> dict:
+    deadline = time.monotonic() + timeout
+    while (job := store.get(job_id))['status'] not in statuses:
+        assert time.monotonic() < deadline, f'job {job_id} still {job["status"]}'
+        time.sleep(0.02)
+    return job
+
+
+def _wait_for_release(root: str, timeout: float = 10):
+    """Waits until the runner let go of the corpus lock, the last step of a job after its status."""
+    deadline = time.monotonic() + timeout
+    while (lock := try_lock_corpus(root)) is None:
+        assert time.monotonic() < deadline, 'corpus lock still held'
+        time.sleep(0.02)
+    lock.close()
+
+
+def test_job_runs_and_reports_progress(store, tmp_path):
+    def update(context):
+        context.set_total(3)
+        for _ in range(3):
+            context.advance()
+
+    runner = JobRunner(store, {'update': update})
+    job, created = runner.submit('update', 'default', str(tmp_path / 'docu'), {'full': True})
+    assert created and job['params'] == {'full': True}
+
+    job = _wait_for(store, job['id'], ('done', 'failed'))
+    assert job['status'] == 'done'
+    assert (job['done'], job['total'], job['attempts']) == (3, 3, 1)
+
+
+def test_one_active_job_per_corpus(store, tmp_path):
+    release = threading.Event()
+    runner = JobRunner(store, {'update': lambda context: release.wait(10)})
+    first, _ = runner.submit('update', 'default', str(tmp_path / 'docu'))
+    second, created = runner.submit('update', 'default', str(tmp_path / 'docu'))
+    assert not created and second['id'] == first['id']
+    release.set()
+    _wait_for(store, first['id'], ('done',))
+
+
+def test_failed_job_keeps_its_error(store, tmp_path):
+    def update(context):
+        raise RuntimeError('crawl failed')
+
+    runner = JobRunner(store, {'update': update})
+    job, _ = runner.submit('update', 'default', str(tmp_path / 'docu'))
+    job = _wait_for(store, job['id'], ('done', 'failed'))
+    assert job['status'] == 'failed' and job['error'] == 'crawl failed'
+
+
+def test_cancel_running_job(store, tmp_path):
+    started, pages = threading.Event(), []
+
+    def update(context):
+        started.set()
+        for page in range(1000):
+            context.check_cancelled()
+            pages.append(page)
+            time.sleep(0.01)
+
+    runner = JobRunner(store, {'update': update})
+    job, _ = runner.submit('update', 'default', str(tmp_path / 'docu'))
+    assert started.wait(10)
+    assert runner.cancel(job['id'])['cancel_requested']
+
+    job = _wait_for(store, job['id'], ('done', 'cancelled', 'failed'))
+    assert job['status'] == 'cancelled'
+    assert len(pages) < 1000
+    _wait_for_release(str(tmp_path / 'docu'))
+
+
+def test_cancel_queued_job(store, tmp_path):
+    root = str(tmp_path / 'docu')
+    lock = try_lock_corpus(root)
+    try:
+        runner = JobRunner(store, {'update': lambda context: None})
+        job, _ = runner.submit('update', 'default', root)
+        assert runner.cancel(job['id'])['status'] == 'cancelled'
+    finally:
+        lock.close()
+    time.sleep(0.2)
+    assert store.get(job['id'])['status'] == 'cancelled'
+
+
+def test_job_waits_for_the_corpus_lock(store, tmp_path):
+    root = str(tmp_path / 'docu')
+    lock = try_lock_corpus(root)
+    runner = JobRunner(store, {'update': lambda context: None})
+    job, _ = runner.submit('update', 'default', root)
+    time.sleep(0.2)
+    assert store.get(job['id'])['status'] == 'queued'
+    lock.close()
+    _wait_for(store, job['id'], ('done',))
+
+
+def test_orphaned_job_resumes_from_its_checkpoints(store, tmp_path):
+    root = str(tmp_path / 'docu')
+    os.makedirs(root)
+    # A worker claimed the job, finished the first page and died without releasing anything but its lock
+    job, _ = store.create('update', 'default', root, {})
+    assert store.claim(job['id'])
+    store.put_checkpoint('default', 'update', 'https://docs/a', 'hash-a')
+
+    seen = {}
+
+    def update(context):
+        seen['resumed'] = context.resumed
+        seen['checkpoints'] = [context.checkpoint('https://docs/a'), context.checkpoint('https://docs/b')]
+        context.save_checkpoint('https://docs/b', 'hash-b')
+
+    JobRunner(store, {'update': update})
+    job = _wait_for(store, job['id'], ('done', 'failed'))
+    _wait_for_release(root)
+
+    assert job['status'] == 'done' and job['attempts'] == 2
+    assert seen == {'resumed': True, 'checkpoints': ['hash-a', None]}
+    # A finished job drops its checkpoints, the next update starts over
+    assert store.get_checkpoint('default', 'update', 'https://docs/a') is None
+
+
+def test_failed_job_keeps_its_checkpoints(store, tmp_path):
+    def update(context):
+        context.save_checkpoint('https://docs/a', 'hash-a')
+        raise RuntimeError('ollama down')
+
+    runner = JobRunner(store, {'update': update})
+    job, _ = runner.submit('update', 'default', str(tmp_path / 'docu'))
+    _wait_for(store, job['id'], ('failed',))
+    assert store.get_checkpoint('default', 'update', 'https://docs/a') == 'hash-a'
+
+
+def test_unknown_job_kind(store, tmp_path):
+    with pytest.raises(ValueError, match='Unknown job kind'):
+        JobRunner(store, {'update': lambda context: None}).submit('rebuild', 'default', str(tmp_path / 'docu'))
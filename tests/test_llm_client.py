@@ -0,0 +1,103 @@
+import threading
+
+import pytest
+
+from ChatBotProxy.main_engine.llm_client import OllamaClient
+
+ANSWER = 'The answer has five tokens.'
+
+
+@pytest.fixture
+def client_env(monkeypatch):
+    monkeypatch.setenv('OLLAMA_RETRIES', '2')
+    monkeypatch.setenv('OLLAMA_RETRY_BACKOFF', '0')
+    monkeypatch.setenv('OLLAMA_FAILURE_COOLDOWN', '60')
+    monkeypatch.setenv('OLLAMA_READ_TIMEOUT', '10')
+    monkeypatch.setenv('OLLAMA_KEEP_ALIVE', '5m')
+    monkeypatch.setenv('OLLAMA_NUM_CTX', '4096')
+    monkeypatch.setenv('OLLAMA_NUM_PREDICT', '0')
+
+
+def test_generate_sends_keep_alive_and_options(client_env, fake_ollama):
+    server = fake_ollama(answer=ANSWER)
+    result = OllamaClient([server.url]).generate('question', 'phi4')
+    assert result == {'answer': ANSWER}
+    assert server.requests == [{'prompt': 'question', 'model': 'phi4', 'stream': False, 'keep_alive': '5m',
+                                'options': {'num_ctx': 4096}}]
+
+
+def test_generate_retries_server_errors(client_env, fake_ollama):
+    server = fake_ollama(answer=ANSWER, fail_first=2)
+    assert OllamaClient([server.url]).generate('question', 'phi4') == {'answer': ANSWER}
+    assert len(server.requests) == 3
+
+
+def test_generate_gives_up_after_the_retries(client_env, fake_ollama):
+    server = fake_ollama(answer=ANSWER, fail_first=3)
+    result = OllamaClient([server.url]).generate('question', 'phi4')
+    assert 'HTTP 503' in result['error']
+    assert len(server.requests) == 3
+
+
+def test_failover_and_cooldown(client_env, fake_ollama):
+    failing, healthy = fake_ollama(answer=ANSWER, fail_first=100), fake_ollama(answer=ANSWER)
+    client = OllamaClient([failing.url, healthy.url])
+    for _ in range(4):
+        assert client.generate('question', 'phi4') == {'answer': ANSWER}
+    # The failing server is skipped for OLLAMA_FAILURE_COOLDOWN seconds after its first 503
+    assert len(failing.requests) == 1
+    assert len(healthy.requests) == 4
+
+
+def test_failed_server_is_used_again_after_the_cooldown(client_env, fake_ollama, monkeypatch):
+    monkeypatch.setenv('OLLAMA_FAILURE_COOLDOWN', '0')
+    failing, healthy = fake_ollama(answer=ANSWER, fail_first=1), fake_ollama(answer=ANSWER)
+    client = OllamaClient([failing.url, healthy.url])
+    for _ in range(4):
+        assert client.generate('question', 'phi4') == {'answer': ANSWER}
+    assert len(failing.requests) > 1
+
+
+def test_connection_errors_fail_over(client_env, fake_ollama):
+    healthy = fake_ollama(answer=ANSWER)
+    client = OllamaClient(['http://127.0.0.1:1', healthy.url])
+    for _ in range(2):
+        assert client.generate('question', 'phi4') == {'answer': ANSWER}
+
+
+def test_stream(client_env, fake_ollama):
+    server = fake_ollama(answer=ANSWER)
+    chunks = list(OllamaClient([server.url]).stream('question', 'phi4'))
+    assert ''.join(chunk['token'] for chunk in chunks[:-1]) == ANSWER
+    assert chunks[-1]['done'] and chunks[-1]['stats']['eval_count'] == 5
+
+
+def test_stream_retries_before_the_first_token(client_env, fake_ollama):
+    server = fake_ollama(answer=ANSWER, fail_first=1)
+    chunks = list(OllamaClient([server.url]).stream('question', 'phi4'))
+    assert ''.join(chunk.get('token', '') for chunk in chunks) == ANSWER
+    assert 'error' not in chunks[-1]
+    assert len(server.requests) == 2
+
+
+def test_stream_is_not_retried_after_the_first_token(client_env, fake_ollama):
+    server = fake_ollama(answer=ANSWER, cut_after=2)
+    chunks = list(OllamaClient([server.url]).stream('question', 'phi4'))
+    assert [chunk['token'] for chunk in chunks[:-1]] == ['The ', 'answer ']
+    assert 'stream ended early' in chunks[-1]['error'] and chunks[-1]['done']
+    assert len(server.requests) == 1
+
+
+def test_max_concurrency_per_server(client_env, fake_ollama, monkeypatch):
+    monkeypatch.setenv('OLLAMA_MAX_CONCURRENCY', '2')
+    server = fake_ollama(answer=ANSWER, token_delay=0.02)
+    client = OllamaClient([server.url])
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.generate('question', 'phi4')))
+               for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [{'answer': ANSWER}] * 6
+    assert server.max_concurrent == 2
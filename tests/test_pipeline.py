@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+from ChatBotProxy.main_engine.pipeline import Pipeline, Stage
+
+
+def test_items_pass_all_stages():
+    batch = []
+
+    def collect(item):
+        batch.append(item)
+        if len(batch) == 3:
+            yield list(batch)
+            batch.clear()
+
+    pipeline = Pipeline([Stage('double', lambda item: [item, item], concurrency=3),
+                         Stage('square', lambda item: [item * item], concurrency=2),
+                         Stage('batch', collect, flush=lambda: [list(batch)] if batch else [])], queue_size=2)
+    batches = pipeline.run(range(10))
+    assert sorted(item for batch in batches for item in batch) == sorted([i * i for i in range(10)] * 2)
+    assert sorted(len(batch) for batch in batches) == [2] + [3] * 6
+
+
+def test_stage_error_is_raised_by_run():
+    def fail(item):
+        if item == 5:
+            raise ValueError('broken page')
+        return [item]
+
+    with pytest.raises(ValueError, match='broken page'):
+        Pipeline([Stage('fail', fail, concurrency=2), Stage('pass', lambda item: [item])]).run(range(100))
+
+
+def test_error_stops_the_other_stages():
+    started = []
+
+    def slow(item):
+        started.append(item)
+        time.sleep(0.01)
+        return [item]
+
+    def fail(item):
+        raise RuntimeError('embedding failed')
+
+    with pytest.raises(RuntimeError, match='embedding failed'):
+        Pipeline([Stage('slow', slow), Stage('fail', fail)], queue_size=1).run(range(1000))
+    assert len(started) < 1000
+
+
+def test_flush_error_is_raised_by_run():
+    def flush():
+        raise OSError('disk full')
+
+    with pytest.raises(OSError, match='disk full'):
+        Pipeline([Stage('write', lambda item: [], flush=flush)]).run(range(3))
+
+
+def test_input_error_is_raised_by_run():
+    def pages():
+        yield 1
+        raise ConnectionError('crawl failed')
+
+    with pytest.raises(ConnectionError, match='crawl failed'):
+        Pipeline([Stage('pass', lambda item: [item])]).run(pages())
+
+
+def test_no_threads_are_left_behind():
+    before = threading.active_count()
+    with pytest.raises(ValueError):
+        Pipeline([Stage('fail', lambda item: int('x'), concurrency=4)]).run(range(10))
+    assert threading.active_count() == before
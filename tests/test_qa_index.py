@@ -0,0 +1,56 @@
+from ChatBotProxy.main_engine.qa_index import parse_qa_pairs
+
+
+def test_labelled_questions_and_answers():
+    text = ('Here are some questions:\n\n'
+            '1. **Question:** How do I create a sample?\n'
+            '   **Answer:** Open the collection and click *Create Sample*.\n'
+            '   The sample shows up in the list.\n\n'
+            '2. **Question:** Can I delete a reaction?\n'
+            '   **Answer:** Yes, with the trash icon.\n')
+    assert parse_qa_pairs(text) == [
+        ('How do I create a sample?', 'Open the collection and click *Create Sample*.\nThe sample shows up in the list.'),
+        ('Can I delete a reaction?', 'Yes, with the trash icon.'),
+    ]
+
+
+def test_short_labels_and_headings():
+    text = ('### Question 1 - What is a collection?\n'
+            'A: A folder for samples.\n'
+            'Q2: How do I share it?\n'
+            '- A2: With the share button.\n')
+    assert parse_qa_pairs(text) == [
+        ('What is a collection?', 'A folder for samples.'),
+        ('How do I share it?', 'With the share button.'),
+    ]
+
+
+def test_numbered_questions_without_answer_labels():
+    text = ('1. How do I log in?\n'
+            'Use your institution account.\n\n'
+            '### 2. Where is the settings page?\n'
+            'In the user menu.\n')
+    assert parse_qa_pairs(text) == [
+        ('How do I log in?', 'Use your institution account.'),
+        ('Where is the settings page?', 'In the user menu.'),
+    ]
+
+
+def test_question_spanning_lines():
+    text = ('Question: When I import a file\n'
+            'which formats are supported?\n'
+            'Answer: CSV and XLSX.\n')
+    assert parse_qa_pairs(text) == [('When I import a file which formats are supported?', 'CSV and XLSX.')]
+
+
+def test_questions_without_answers_are_dropped():
+    text = ('Question: Unanswered?\n'
+            'Question: Answered?\n'
+            'Answer: Yes.\n'
+            'Question: Empty answer?\n'
+            'Answer: **\n')
+    assert parse_qa_pairs(text) == [('Answered?', 'Yes.')]
+
+
+def test_no_questions():
+    assert parse_qa_pairs('The page does not contain enough information.') == []